@@ -1 +1 @@
-__all__ = ["cfpq", "cyk", "rpq"]
+__all__ = ["cfpq", "cyk", "dynamic_rpq", "planner", "rpq"]
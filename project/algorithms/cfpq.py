@@ -1,13 +1,29 @@
+from functools import partial
+from itertools import chain
 from typing import Callable
+import numpy as np
 import pyformlang.cfg as c
 from networkx import MultiDiGraph
-from scipy.sparse import dok_array, csr_array, eye
+from scipy.sparse import csr_array
 
 from project.utils.cfg import cfg_to_wcnf
-from project.utils.ecfg import ecfg_by_cfg
-from project.utils.rsm import bm_by_rsm, rsm_by_ecfg, minimize_rsm
-from project.utils.automata import nfa_by_graph
-from project.utils.binary_matrix import bm_by_nfa, intersect, transitive_closure
+from project.utils.backend import SPARSE, common_backend
+from project.utils.binary_matrix import (
+    BinaryMatrix,
+    csr_by_coo,
+    intersect,
+    transitive_closure,
+)
+from project.utils.cache import cached_graph_index, compile_cfg
+from project.utils.lazy_kron import LazyIntersection, lazy_transitive_closure
+from project.utils.parallel import parallel_matmul, parallel_matmul_add
+from project.utils.results import (
+    DEFAULT_CHUNK_SIZE,
+    IndexResult,
+    iter_chunks,
+    node_table,
+)
+from project.utils.scc import condensation, topological_order
 
 
 def helling_cfpq(
@@ -17,20 +33,91 @@ def helling_cfpq(
     fn: set = None,
     start: str | c.Variable = "S",
 ) -> set:
-    return _cfpq_transitive_closure(
-        graph, query, sn, fn, start, helling_constrained_transitive_closure
+    return set(chain.from_iterable(iter_helling_cfpq(graph, query, sn, fn, start)))
+
+
+def iter_helling_cfpq(
+    graph: MultiDiGraph,
+    query: c.CFG,
+    sn: set = None,
+    fn: set = None,
+    start: str | c.Variable = "S",
+    batch_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """
+    Computes helling_cfpq decoding pairs of nodes lazily.
+
+    :param batch_size: Maximum number of pairs in one yielded list.
+    :return: Generator of lists of pairs of nodes.
+    """
+    yield from iter_chunks(
+        *helling_cfpq_indices(graph, query, sn, fn, start), chunk_size=batch_size
     )
 
 
+def helling_cfpq_indices(
+    graph: MultiDiGraph,
+    query: c.CFG,
+    sn: set = None,
+    fn: set = None,
+    start: str | c.Variable = "S",
+) -> IndexResult:
+    """
+    Computes helling_cfpq returning pairs of nodes as index arrays.
+
+    :return: Answers with indices of nodes in graph.
+    """
+    return _cfpq_indices(graph, query, sn, fn, start, _helling_closure_matrices)
+
+
 def matrix_cfpq(
     graph: MultiDiGraph,
     query: c.CFG,
     sn: set = None,
     fn: set = None,
     start: str | c.Variable = "S",
+    key: str | None = None,
 ) -> set:
-    return _cfpq_transitive_closure(
-        graph, query, sn, fn, start, matrix_constrained_transitive_closure
+    return set(
+        chain.from_iterable(iter_matrix_cfpq(graph, query, sn, fn, start, key=key))
+    )
+
+
+def iter_matrix_cfpq(
+    graph: MultiDiGraph,
+    query: c.CFG,
+    sn: set = None,
+    fn: set = None,
+    start: str | c.Variable = "S",
+    batch_size: int = DEFAULT_CHUNK_SIZE,
+    key: str | None = None,
+):
+    """
+    Computes matrix_cfpq decoding pairs of nodes lazily.
+
+    :param batch_size: Maximum number of pairs in one yielded list.
+    :return: Generator of lists of pairs of nodes.
+    """
+    yield from iter_chunks(
+        *matrix_cfpq_indices(graph, query, sn, fn, start, key), chunk_size=batch_size
+    )
+
+
+def matrix_cfpq_indices(
+    graph: MultiDiGraph,
+    query: c.CFG,
+    sn: set = None,
+    fn: set = None,
+    start: str | c.Variable = "S",
+    key: str | None = None,
+) -> IndexResult:
+    """
+    Computes matrix_cfpq returning pairs of nodes as index arrays.
+
+    :return: Answers with indices of nodes in graph.
+    """
+    return _cfpq_indices(
+        graph, query, sn, fn, start, partial(_matrix_closure_matrices, key=key)
     )
 
 
@@ -40,87 +127,182 @@ def tensor_cfpq(
     sn: set | None = None,
     fn: set | None = None,
     start: str | c.Variable = c.Variable("S"),
+    lazy: bool = False,
+    key: str | None = None,
 ) -> set:
-    return _cfpq_transitive_closure(
+    return set(
+        chain.from_iterable(
+            iter_tensor_cfpq(graph, query, sn, fn, start, lazy, key=key)
+        )
+    )
+
+
+def iter_tensor_cfpq(
+    graph: MultiDiGraph,
+    query: str | c.CFG,
+    sn: set | None = None,
+    fn: set | None = None,
+    start: str | c.Variable = c.Variable("S"),
+    lazy: bool = False,
+    batch_size: int = DEFAULT_CHUNK_SIZE,
+    key: str | None = None,
+):
+    """
+    Computes tensor_cfpq decoding pairs of nodes lazily.
+
+    :param batch_size: Maximum number of pairs in one yielded list.
+    :return: Generator of lists of pairs of nodes.
+    """
+    yield from iter_chunks(
+        *tensor_cfpq_indices(graph, query, sn, fn, start, lazy, key),
+        chunk_size=batch_size,
+    )
+
+
+def tensor_cfpq_indices(
+    graph: MultiDiGraph,
+    query: str | c.CFG,
+    sn: set | None = None,
+    fn: set | None = None,
+    start: str | c.Variable = c.Variable("S"),
+    lazy: bool = False,
+    key: str | None = None,
+) -> IndexResult:
+    """
+    Computes tensor_cfpq returning pairs of nodes as index arrays.
+
+    :return: Answers with indices of nodes in graph.
+    """
+    return _cfpq_indices(
         graph,
         query,
         sn,
         fn,
         start,
-        tensor_constrained_transitive_closure,
+        partial(_tensor_closure_matrices, lazy=lazy, key=key),
     )
 
 
-def _cfpq_transitive_closure(
+def _cfpq_indices(
     graph: MultiDiGraph,
     query: str | c.CFG,
     start_nodes: set | None,
     final_nodes: set | None,
     start_var: str | c.Variable,
-    tc: Callable,
-) -> set:
+    closure: Callable,
+) -> IndexResult:
     if not isinstance(start_var, c.Variable):
         start_var = c.Variable(start_var)
-    if start_nodes is None:
-        start_nodes = graph.nodes
-    if final_nodes is None:
-        final_nodes = graph.nodes
     if start_var is None:
         start_var = query.start_symbol
 
-    ctc = tc(graph, query)
+    nodes, matrices = closure(graph, query)
+    nodes = node_table(nodes)
+    if start_var not in matrices:
+        empty = np.array([], dtype=np.int64)
+        return IndexResult(nodes, empty, empty)
+    rows, cols = matrices[start_var].nonzero()
+
+    answers = np.ones(len(rows), dtype=bool)
+    if start_nodes is not None:
+        answers &= np.array([n in start_nodes for n in nodes], dtype=bool)[rows]
+    if final_nodes is not None:
+        answers &= np.array([n in final_nodes for n in nodes], dtype=bool)[cols]
+
+    return IndexResult(nodes, rows[answers], cols[answers])
+
 
+def _triples(nodes: list, matrices: dict) -> set:
     return {
-        (start, final)
-        for start, var, final in ctc
-        if start in start_nodes and var == start_var and final in final_nodes
+        (nodes[i], v, nodes[j])
+        for v, m in matrices.items()
+        for i, j in zip(*m.nonzero())
+    }
+
+
+def _helling_closure_matrices(graph: MultiDiGraph, cfg: c.CFG) -> tuple:
+    nodes = list(graph.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    pairs = {}
+    for n1, v, n2 in helling_constrained_transitive_closure(graph, cfg):
+        pairs.setdefault(v, []).append((index[n1], index[n2]))
+
+    return nodes, {
+        v: csr_by_coo(*np.array(ij).T, len(nodes)) for v, ij in pairs.items()
     }
 
 
 def helling_constrained_transitive_closure(graph: MultiDiGraph, cfg: c.CFG) -> set:
+    """
+    Computes triples (node from, variable, node to) derivable in graph by Hellings
+    algorithm. Facts are indexed by their start and end nodes with variables and
+    productions by their bodies, so every fact taken from the worklist is joined with
+    its actual partners only.
+
+    :param graph: Graph with labeled edges.
+    :param cfg: Context-free grammar.
+    :return: Set of triples.
+    """
     cfg = cfg_to_wcnf(cfg)
-    eps_prods = set()
-    term_prods = {}
-    var_prods = {}
+    eps_heads = set()
+    heads_by_terminal = {}
+    # Heads of productions A -> B C by B and C: partners of fact of B are facts of C
+    # starting at its end and vice versa
+    right_by_left = {}
+    left_by_right = {}
     for p in cfg.productions:
         match p.body:
             case [c.Epsilon()]:
-                eps_prods.add(p.head)
+                eps_heads.add(p.head)
             case [c.Terminal() as t]:
-                term_prods.setdefault(p.head, set()).add(t)
+                heads_by_terminal.setdefault(t.value, set()).add(p.head)
             case [c.Variable() as v1, c.Variable() as v2]:
-                var_prods.setdefault(p.head, set()).add((v1, v2))
-
-    res = {(n, v, n) for n in graph.nodes for v in eps_prods} | {
-        (n1, v, n2)
-        for n1, n2, l in graph.edges.data("label")
-        for v in term_prods
-        if c.Terminal(l) in term_prods[v]
-    }
+                right_by_left.setdefault(v1, {}).setdefault(v2, set()).add(p.head)
+                left_by_right.setdefault(v2, {}).setdefault(v1, set()).add(p.head)
+
+    res = set()
+    ends_by_start = {}
+    starts_by_end = {}
+    queue = []
+
+    def add(start, v, end):
+        if (start, v, end) in res:
+            return
+        res.add((start, v, end))
+        ends_by_start.setdefault((start, v), set()).add(end)
+        starts_by_end.setdefault((end, v), set()).add(start)
+        queue.append((start, v, end))
+
+    for n in graph.nodes:
+        for v in eps_heads:
+            add(n, v, n)
+    for n1, n2, l in graph.edges.data("label"):
+        for v in heads_by_terminal.get(l, ()):
+            add(n1, v, n2)
 
-    queue = res.copy()
-    while len(queue) > 0:
+    while queue:
         start1, v_i, end1 = queue.pop()
-
-        tmp = set()
-        for start2, v_j, end2 in res:
-            if end2 == start1:
-                for v_k in var_prods:
-                    if (v_j, v_i) in var_prods[v_k] and (start2, v_k, end1) not in res:
-                        queue.add((start2, v_k, end1))
-                        tmp.add((start2, v_k, end1))
-            if start2 == end1:
-                for v_k in var_prods:
-                    if (v_i, v_j) in var_prods[v_k] and (start1, v_k, end2) not in res:
-                        queue.add((start1, v_k, end2))
-                        tmp.add((start1, v_k, end2))
-
-        res |= tmp
+        # Fact is the right operand of facts ending at its start
+        for v_j, heads in left_by_right.get(v_i, {}).items():
+            for start2 in list(starts_by_end.get((start1, v_j), ())):
+                for v_k in heads:
+                    add(start2, v_k, end1)
+        # Fact is the left operand of facts starting at its end
+        for v_j, heads in right_by_left.get(v_i, {}).items():
+            for end2 in list(ends_by_start.get((end1, v_j), ())):
+                for v_k in heads:
+                    add(start1, v_k, end2)
 
     return res
 
 
 def matrix_constrained_transitive_closure(graph: MultiDiGraph, cfg: c.CFG) -> set:
+    return _triples(*_matrix_closure_matrices(graph, cfg))
+
+
+def _matrix_closure_matrices(
+    graph: MultiDiGraph, cfg: c.CFG, key: str | None = None
+) -> tuple:
     cfg = cfg_to_wcnf(cfg)
     eps_prods = set()
     term_prods = {}
@@ -134,52 +316,134 @@ def matrix_constrained_transitive_closure(graph: MultiDiGraph, cfg: c.CFG) -> se
             case [c.Variable() as v1, c.Variable() as v2]:
                 var_prods.add((p.head, v1, v2))
 
-    nodes = {n: i for i, n in enumerate(graph.nodes)}
-    matrix: dict[c.Variable, dok_array] = {
-        v: dok_array((len(nodes), len(nodes)), dtype=bool) for v in cfg.variables
-    }
+    graph_bm = cached_graph_index(graph, key=key).bm(term_prods)
+    nodes = [st.value for st in graph_bm.states]
+    matrix = _terminal_matrices(graph_bm, cfg.variables, eps_prods, term_prods)
+    for variables, prods in _variable_schedule(cfg.variables, var_prods):
+        _semi_naive_closure(matrix, variables, prods)
+
+    return list(nodes), matrix
 
-    for n1, n2, l in graph.edges.data("label"):
-        i = nodes[n1]
-        j = nodes[n2]
-        for v in term_prods.setdefault(l, set()):
-            matrix[v][i, j] = True
 
-    for tmp in matrix.values():
-        tmp.tocsr()
+def _terminal_matrices(
+    graph_bm: BinaryMatrix, variables, eps_prods: set, term_prods: dict
+) -> dict:
+    """
+    Builds initial matrix of every variable in one shot from COO arrays of graph
+    matrices of its terminals, plus diagonal if variable derives epsilon.
 
-    diag = csr_array(eye(len(nodes), dtype=bool))
+    :return: Dictionary of boolean CSR matrices by variables.
+    """
+    n = len(graph_bm.states)
+    coo = {v: ([], []) for v in variables}
+    diag = np.arange(n)
     for v in eps_prods:
-        matrix[v] += diag
+        coo[v][0].append(diag)
+        coo[v][1].append(diag)
+    for label, m in graph_bm.matrix.items():
+        rows, cols = SPARSE.nonzero(SPARSE.convert(m))
+        for v in term_prods[label]:
+            coo[v][0].append(rows)
+            coo[v][1].append(cols)
+
+    empty = np.array([], dtype=np.int64)
+    return {
+        v: csr_by_coo(np.concatenate([empty, *rows]), np.concatenate([empty, *cols]), n)
+        for v, (rows, cols) in coo.items()
+    }
 
-    changed = True
-    while changed:
-        changed = False
-        for h, b1, b2 in var_prods:
-            nnz_old = matrix[h].nnz
-            matrix[h] += matrix[b1] @ matrix[b2]
-            changed |= matrix[h].nnz != nnz_old
 
-    nodes = {i: n for n, i in nodes.items()}
-    result = set()
-    for v, tmp in matrix.items():
-        for i, j in zip(*tmp.nonzero()):
-            result.add((nodes[i], v, nodes[j]))
-    return result
+def _variable_schedule(variables, var_prods) -> list:
+    """
+    Groups variables by strongly connected components of their dependencies, a head
+    depends on both variables of its body, and sorts components topologically.
+
+    :return: List of pairs of set of variables of component and productions with
+        heads in it, every component follows components it depends on.
+    """
+    variables = list(variables)
+    if not variables:
+        return []
+    index = {v: i for i, v in enumerate(variables)}
+    deps = [(index[b], index[h]) for h, b1, b2 in var_prods for b in (b1, b2)]
+    rows, cols = np.array(deps, dtype=np.int64).reshape(-1, 2).T
+    labels, dag, _ = condensation(csr_by_coo(rows, cols, len(variables)))
+
+    components = {}
+    for v, label in zip(variables, labels):
+        components.setdefault(label, (set(), []))[0].add(v)
+    for prod in var_prods:
+        components[labels[index[prod[0]]]][1].append(prod)
+
+    return [components[label] for label in topological_order(dag)]
+
+
+def _semi_naive_closure(matrix: dict, variables: set, prods: list):
+    """
+    Completes matrices of variables of one component by semi-naive iteration: every
+    round joins only facts derived in the previous round, ``ΔB1 @ B2 + B1 @ ΔB2``,
+    and only for productions with changed body variables. Variables of other
+    components are complete, so productions over them are joined once.
+    """
+    for h, b1, b2 in prods:
+        if b1 not in variables and b2 not in variables:
+            matrix[h] = parallel_matmul_add(matrix[h], matrix[b1], matrix[b2])
+
+    recursive = [p for p in prods if p[1] in variables or p[2] in variables]
+    # Only variables with facts derived in the previous round have deltas
+    delta = {v: matrix[v] for v in variables if matrix[v].nnz}
+    while recursive and delta:
+        new = {}
+        for h, b1, b2 in recursive:
+            for lhs, rhs in ((delta.get(b1), matrix[b2]), (matrix[b1], delta.get(b2))):
+                if lhs is None or rhs is None:
+                    continue
+                product = parallel_matmul(lhs, rhs)
+                new[h] = new[h] + product if h in new else product
+
+        delta = {}
+        for h, m in new.items():
+            m = m > matrix[h]
+            if m.nnz:
+                delta[h] = m
+                matrix[h] = matrix[h] + m
+
+
+def _lazy_closure_indices(rsm_d: BinaryMatrix, graph_d: BinaryMatrix) -> list:
+    intersection = LazyIntersection(rsm_d, graph_d)
+    sources = intersection.start_indices()
+    rows, cols = lazy_transitive_closure(intersection, sources).nonzero()
+    return list(zip(sources[rows], cols))
+
+
+def tensor_constrained_transitive_closure(
+    graph: MultiDiGraph, cfg: c.CFG, lazy: bool = False
+) -> set:
+    return _triples(*_tensor_closure_matrices(graph, cfg, lazy))
 
 
-def tensor_constrained_transitive_closure(graph: MultiDiGraph, cfg: c.CFG) -> set:
-    rsm_d = bm_by_rsm(minimize_rsm(rsm_by_ecfg(ecfg_by_cfg(cfg))))
-    graph_d = bm_by_nfa(nfa_by_graph(graph))
+def _tensor_closure_matrices(
+    graph: MultiDiGraph, cfg: c.CFG, lazy: bool = False, key: str | None = None
+) -> tuple:
+    rsm_d = compile_cfg(cfg).bm
+    # Matrices of labels are shared with cached index, so variable matrices are added
+    # into own dict of graph labels from RSM alphabet
+    graph_d = cached_graph_index(graph, key=key).bm(rsm_d.matrix)
+    n = len(graph_d.states)
+    backend = common_backend(*graph_d.matrix.values())
 
-    diag = csr_array(eye(len(graph_d.states), dtype=bool))
+    diag = backend.eye(n)
     for v in cfg.get_nullable_symbols():
-        graph_d.matrix[v.value] += diag
+        graph_d.matrix[v.value] = backend.add(
+            graph_d.matrix.get(v.value, backend.zeros((n, n))), diag
+        )
 
     transitive_closure_size = 0
     while True:
-        transitive_closure_indices = list(
-            zip(*transitive_closure(intersect(rsm_d, graph_d)))
+        transitive_closure_indices = (
+            _lazy_closure_indices(rsm_d, graph_d)
+            if lazy
+            else list(zip(*transitive_closure(intersect(rsm_d, graph_d))))
         )
 
         if len(transitive_closure_indices) == transitive_closure_size:
@@ -187,26 +451,23 @@ def tensor_constrained_transitive_closure(graph: MultiDiGraph, cfg: c.CFG) -> se
         transitive_closure_size = len(transitive_closure_indices)
 
         for i, j in transitive_closure_indices:
-            r_i, r_j = i // len(graph_d.states), j // len(graph_d.states)
+            r_i, r_j = i // n, j // n
             s, f = rsm_d.states[r_i], rsm_d.states[r_j]
             if s.is_start and f.is_final:
                 v = s.value[0]
 
-                g_i, g_j = i % len(graph_d.states), j % len(graph_d.states)
-                ij_graph_adj = csr_array(
-                    ([True], ([g_i], [g_j])),
-                    shape=(len(graph_d.states), len(graph_d.states)),
-                    dtype=bool,
+                g_i, g_j = i % n, j % n
+                ij_graph_adj = backend.convert(
+                    csr_array(([True], ([g_i], [g_j])), shape=(n, n), dtype=bool)
                 )
 
                 if v in graph_d.matrix:
-                    graph_d.matrix[v] += ij_graph_adj
+                    graph_d.matrix[v] = backend.add(graph_d.matrix[v], ij_graph_adj)
                 else:
-                    graph_d.matrix[v] = ij_graph_adj.copy()
-
-    result = set()
-    for v, adj in graph_d.matrix.items():
-        if isinstance(v, c.Variable):
-            for i, j in zip(*adj.nonzero()):
-                result.add((graph_d.states[i].value, v, graph_d.states[j].value))
-    return result
+                    graph_d.matrix[v] = ij_graph_adj
+
+    return [st.value for st in graph_d.states], {
+        v: SPARSE.convert(adj)
+        for v, adj in graph_d.matrix.items()
+        if isinstance(v, c.Variable)
+    }
@@ -0,0 +1,220 @@
+import numpy as np
+from networkx import MultiDiGraph
+from pyformlang.regular_expression import Regex
+from scipy.sparse import csr_array, kron
+
+from project.utils.backend import SPARSE
+from project.utils.binary_matrix import csr_by_coo
+from project.utils.cache import compile_regex
+from project.utils.parallel import parallel_matmul
+from project.utils.results import IndexResult, iter_chunks, node_table, unique_pairs
+
+
+def _resized(matrix: csr_array, shape: tuple) -> csr_array:
+    extra_rows = shape[0] - matrix.shape[0]
+    indptr = np.concatenate(
+        [matrix.indptr, np.full(extra_rows, matrix.indptr[-1], matrix.indptr.dtype)]
+    )
+    return csr_array((matrix.data, matrix.indices, indptr), shape=shape)
+
+
+def _masked(a: csr_array, mask: csr_array) -> csr_array:
+    return csr_array(a.multiply(mask), dtype=bool)
+
+
+class IncrementalRPQ:
+    """
+    Answers of Regular Path Querying for one regular expression maintained while edges
+    of the graph are added and removed.
+
+    The index keeps reachability of product automaton states from start product states
+    by non-empty paths. Product state (i, j) of graph node i and query state j has index
+    ``i * k + j``. Every product edge keeps number of labeled graph edges producing it,
+    so it disappears only with the last of them. Insertions propagate only newly reached
+    states, deletions over-delete states derived through removed product edges and then
+    rederive those of them still reachable by other paths (DRed).
+
+    :param graph: Initial graph with labeled edges.
+    :param query: Regular expression.
+    :param start_states: Start states in graph. If None, then every node is the starting,
+        including nodes added later.
+    :param final_states: Final states in graph. If None, then every node is the final,
+        including nodes added later.
+    """
+
+    def __init__(
+        self,
+        graph: MultiDiGraph,
+        query: Regex,
+        start_states: set = None,
+        final_states: set = None,
+    ):
+        query_bm = compile_regex(query).bm
+        self.k = len(query_bm.states)
+        self._query = {
+            label: SPARSE.convert(m).astype(np.int32)
+            for label, m in query_bm.matrix.items()
+        }
+        self._query_starts = np.flatnonzero([st.is_start for st in query_bm.states])
+        self._query_finals = np.array(
+            [st.is_final for st in query_bm.states], dtype=bool
+        )
+        self._start_states = start_states
+        self._final_states = final_states
+
+        self._nodes = []
+        self._index = {}
+        self._edges = {}
+        self._counts = csr_array((0, 0), dtype=np.int32)
+        self._sources = np.array([], dtype=np.int64)
+        self._reach = csr_array((0, 0), dtype=bool)
+
+        self._add_nodes(graph.nodes)
+        self.add_edges(graph.edges.data("label"))
+
+    def _add_nodes(self, nodes):
+        new_nodes = [n for n in dict.fromkeys(nodes) if n not in self._index]
+        if not new_nodes:
+            return
+        beg = len(self._nodes)
+        for n in new_nodes:
+            self._index[n] = len(self._nodes)
+            self._nodes.append(n)
+
+        size = len(self._nodes) * self.k
+        starts = np.array(
+            [
+                beg + i
+                for i, n in enumerate(new_nodes)
+                if self._start_states is None or n in self._start_states
+            ],
+            dtype=np.int64,
+        )
+        self._sources = np.concatenate(
+            [self._sources, np.add.outer(starts * self.k, self._query_starts).ravel()]
+        )
+        self._counts = _resized(self._counts, (size, size))
+        self._reach = _resized(self._reach, (len(self._sources), size))
+
+    def _source_matrix(self) -> csr_array:
+        m = len(self._sources)
+        return csr_by_coo(np.arange(m), self._sources, self._reach.shape)
+
+    def _adjacency(self) -> csr_array:
+        adj = csr_array(self._counts > 0, dtype=bool)
+        adj.eliminate_zeros()
+        return adj
+
+    def _update_edges(self, edges: list, sign: int):
+        counts = {}
+        for u, v, label in edges:
+            key = (self._index[u], label, self._index[v])
+            counts[key] = counts.get(key, self._edges.get(key, 0)) + sign
+            if counts[key] < 0:
+                raise ValueError(f"No edge {u} -> {v} with label {label}")
+
+        # Only graph edges which appear or disappear change product edges
+        changed = {}
+        for (i, label, j), count in counts.items():
+            if (count > 0) != (self._edges.get((i, label, j), 0) > 0):
+                changed.setdefault(label, []).append((i, j))
+            if count:
+                self._edges[(i, label, j)] = count
+            else:
+                self._edges.pop((i, label, j), None)
+
+        n = len(self._nodes)
+        for label, pairs in changed.items():
+            if label in self._query:
+                rows, cols = np.array(pairs, dtype=np.int64).T
+                graph_m = csr_by_coo(rows, cols, n).astype(np.int32)
+                self._counts = self._counts + sign * kron(
+                    graph_m, self._query[label], format="csr"
+                )
+
+    def _propagate(self, front: csr_array, adj: csr_array):
+        front = front > self._reach
+        while front.nnz:
+            self._reach = self._reach + front
+            front = parallel_matmul(front, adj) > self._reach
+
+    def add_edges(self, edges):
+        """
+        Adds labeled edges, nodes not in graph are added too.
+
+        :param edges: Iterable of (node from, node to, label) triples.
+        """
+        edges = list(edges)
+        self._add_nodes(n for u, v, _ in edges for n in (u, v))
+        adj_old = self._adjacency()
+        self._update_edges(edges, 1)
+        adj = self._adjacency()
+        inserted = adj > adj_old
+        if not inserted.nnz:
+            return
+
+        # States reached by new product edges from sources or already reached states
+        self._propagate(
+            parallel_matmul(self._source_matrix() + self._reach, inserted), adj
+        )
+
+    def remove_edges(self, edges):
+        """
+        Removes labeled edges, nodes are kept.
+
+        :param edges: Iterable of (node from, node to, label) triples.
+        :raises ValueError: if some edge is not in graph.
+        """
+        edges = list(edges)
+        for u, v, _ in edges:
+            if u not in self._index or v not in self._index:
+                raise ValueError(f"No edge {u} -> {v}")
+        adj_old = self._adjacency()
+        self._update_edges(edges, -1)
+        adj = self._adjacency()
+        deleted = adj_old > adj
+        if not deleted.nnz:
+            return
+
+        sources = self._source_matrix()
+        # Over-delete every state which might be derived through a deleted product edge
+        front = _masked(parallel_matmul(sources + self._reach, deleted), self._reach)
+        over = front
+        while front.nnz:
+            front = _masked(parallel_matmul(front, adj_old), self._reach) > over
+            over = over + front
+        self._reach = self._reach > over
+
+        # Rederive over-deleted states having another incoming path
+        self._propagate(_masked(parallel_matmul(sources + self._reach, adj), over), adj)
+
+    @property
+    def nodes(self) -> list:
+        return list(self._nodes)
+
+    def indices(self) -> IndexResult:
+        """
+        :return: Current answers with indices of nodes in order of their addition.
+        """
+        graph_finals = np.array(
+            [
+                self._final_states is None or n in self._final_states
+                for n in self._nodes
+            ],
+            dtype=bool,
+        )
+        rows, cols = self._reach.nonzero()
+        finals = graph_finals[cols // self.k] & self._query_finals[cols % self.k]
+        beg_nodes = self._sources[rows[finals]] // self.k
+        end_nodes = cols[finals] // self.k
+
+        return IndexResult(
+            node_table(self._nodes),
+            *unique_pairs(beg_nodes, end_nodes, len(self._nodes)),
+        )
+
+    def pairs(self) -> set:
+        """
+        :return: Current answers as pairs of nodes, like tensor_rpq.
+        """
+        return {pair for chunk in iter_chunks(*self.indices()) for pair in chunk}
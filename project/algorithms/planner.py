@@ -0,0 +1,196 @@
+from collections import namedtuple
+from networkx import MultiDiGraph
+from pyformlang.regular_expression import Regex
+
+from project.algorithms.rpq import bfs_rpq, tensor_rpq
+from project.utils.backend import backend_of
+from project.utils.binary_matrix import BinaryMatrix
+from project.utils.cache import cached_graph_index, compile_regex
+from project.utils.graph_index import GraphIndex
+
+DEFAULT_MEMORY_LIMIT = 1 << 30
+"""
+Default limit of estimated memory of a plan in bytes.
+"""
+
+CELL_BYTES = 8
+"""
+Estimated number of bytes of one nonzero cell of CSR matrix: column index and value with padding.
+"""
+
+SCC_BLOCK_ROWS = 1024
+"""
+Number of bitset rows of condensed closure unpacked at once, see expand_scc_closure.
+"""
+
+QueryStats = namedtuple(
+    "QueryStats",
+    "nodes label_edges starts finals query_states query_starts query_transitions",
+)
+"""
+Namedtuple of statistics of a graph and a query: number of graph nodes, numbers of graph
+edges by labels of query alphabet, numbers of start and final graph nodes, number of DFA
+states, number of start DFA states and number of DFA transitions by labels.
+"""
+
+Estimate = namedtuple("Estimate", "cost memory")
+"""
+Namedtuple of estimated number of elementary operations and bytes of a strategy.
+"""
+
+Plan = namedtuple("Plan", "engine strategy options estimates stats")
+"""
+Namedtuple of chosen engine (tensor_rpq or bfs_rpq), name of strategy, keyword
+arguments of the engine, estimates of all strategies by their names and statistics
+they are based on.
+"""
+
+
+def query_stats(graph_bm: BinaryMatrix, query_bm: BinaryMatrix) -> QueryStats:
+    """
+    Gathers statistics of binary matrices of a graph and a query.
+
+    :param graph_bm: Binary matrix of graph.
+    :param query_bm: Binary matrix of query DFA.
+    :return: Statistics.
+    """
+
+    def nnz(m) -> int:
+        return backend_of(m).nnz(m)
+
+    return QueryStats(
+        nodes=len(graph_bm.states),
+        label_edges={
+            label: nnz(m)
+            for label, m in graph_bm.matrix.items()
+            if label in query_bm.matrix
+        },
+        starts=sum(st.is_start for st in graph_bm.states),
+        finals=sum(st.is_final for st in graph_bm.states),
+        query_states=len(query_bm.states),
+        query_starts=sum(st.is_start for st in query_bm.states),
+        query_transitions={label: nnz(m) for label, m in query_bm.matrix.items()},
+    )
+
+
+def estimate_strategies(stats: QueryStats, processes: int = 1) -> dict:
+    """
+    Estimates costs of RPQ strategies. Product automaton has N = nodes * query_states
+    states and E = sum of label_edges * query_transitions edges by common labels.
+
+    * all-pairs: closure of the whole product by SCC condensation and bitsets of
+      reachable states, about E * N / 64 word operations. Memory is N^2 / 8 bytes of
+      bitsets, unpacked blocks of bitset rows and up to N cells per start product
+      state held both in CSR closure rows and in their coordinates.
+    * multi-source: BFS from every start product state over the product, at most E
+      operations per source and N cells per source.
+    * chunked: the same BFS in bfs_rpq by chunks of start nodes in worker processes,
+      memory of one front of a single start node per process at least.
+
+    :param stats: Statistics of graph and query.
+    :param processes: Number of worker processes of chunked strategy.
+    :return: Dictionary of estimates by names of strategies.
+    """
+    n = stats.nodes * stats.query_states
+    e = sum(
+        edges * stats.query_transitions[label]
+        for label, edges in stats.label_edges.items()
+    )
+    sources = stats.starts * stats.query_starts
+    front_bytes = stats.query_states * (stats.query_states + stats.nodes) * CELL_BYTES
+    return {
+        "all-pairs": Estimate(
+            e * n // 64 + n,
+            n * n // 8
+            + SCC_BLOCK_ROWS * n
+            + 3 * sources * n * CELL_BYTES
+            + e * CELL_BYTES,
+        ),
+        "multi-source": Estimate(sources * (e + 1), sources * n * CELL_BYTES),
+        "chunked": Estimate(
+            sources * (e + 1) // processes,
+            processes * front_bytes,
+        ),
+    }
+
+
+def plan_rpq(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    processes: int = 1,
+    key: str | None = None,
+) -> Plan:
+    """
+    Chooses the cheapest RPQ strategy whose estimated memory fits the limit.
+    Chunked strategy is chosen when no other one fits, its chunk size is the largest one
+    fitting the limit.
+
+    :param graph: Graph with labeled edges, its binary matrix or index, see cached_graph_index.
+    :param query: Regular expression.
+    :param start_states: Start states in graph. If None, then every node in graph is the starting.
+    :param final_states: Final states in graph. If None, then every node in graph is the final.
+    :param memory_limit: Limit of estimated memory in bytes.
+    :param processes: Number of worker processes of chunked strategy.
+    :param key: Key of graph in the cache of query engines, see tensor_rpq.
+    :return: Plan with estimates.
+    """
+    query_bm = compile_regex(query).bm
+    stats = query_stats(
+        cached_graph_index(graph, start_states, final_states, key).bm(query_bm.matrix),
+        query_bm,
+    )
+    estimates = estimate_strategies(stats, processes)
+
+    fitting = [
+        name
+        for name in ("all-pairs", "multi-source")
+        if estimates[name].memory <= memory_limit
+    ]
+    if fitting:
+        strategy = min(fitting, key=lambda name: estimates[name].cost)
+    else:
+        strategy = "chunked"
+
+    if strategy == "all-pairs":
+        return Plan("tensor_rpq", strategy, {"strategy": "scc"}, estimates, stats)
+    if strategy == "multi-source":
+        name = "single-source" if stats.starts == 1 else strategy
+        return Plan("tensor_rpq", name, {"from_sources": True}, estimates, stats)
+
+    front_bytes = estimates["chunked"].memory // processes
+    chunk_size = max(1, memory_limit // (processes * max(front_bytes, 1)))
+    return Plan(
+        "bfs_rpq",
+        strategy,
+        {"separated": True, "chunk_size": chunk_size, "processes": processes},
+        estimates,
+        stats,
+    )
+
+
+def planned_rpq(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    plan: Plan | None = None,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    processes: int = 1,
+    key: str | None = None,
+) -> set:
+    """
+    Computes Regular Path Querying by a plan.
+
+    :param plan: Plan to execute. If None, then it is chosen by plan_rpq.
+    :param key: Key of graph in the cache of query engines, see tensor_rpq.
+    :return: Regular Path Querying
+    """
+    if plan is None:
+        plan = plan_rpq(
+            graph, query, start_states, final_states, memory_limit, processes, key
+        )
+    engine = {"tensor_rpq": tensor_rpq, "bfs_rpq": bfs_rpq}[plan.engine]
+    return engine(graph, query, start_states, final_states, **plan.options, key=key)
@@ -1,165 +1,971 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from tempfile import TemporaryDirectory
+import numpy as np
 from networkx import MultiDiGraph
 from pyformlang.regular_expression import Regex
-from scipy.sparse import csr_array, lil_array, vstack
+from scipy.sparse import csr_array, hstack
 
-from project.utils.automata import dfa_by_regex, nfa_by_graph
+from project.utils.backend import SPARSE, BackendPolicy
 from project.utils.binary_matrix import (
-    bm_by_nfa,
+    BinaryMatrix,
+    bm_with_backend,
+    csr_by_coo,
+    disjoint_union,
     intersect,
+    reversed_bm,
     transitive_closure,
-    direct_sum,
+    sources_transitive_closure,
 )
+from project.utils.cache import cached_graph_index, compile_regex
+from project.utils.graph_index import GraphIndex
+from project.utils.lazy_kron import LazyIntersection, lazy_transitive_closure
+from project.utils.parallel import parallel_matmul
+from project.utils.results import (
+    DEFAULT_CHUNK_SIZE,
+    IndexResult,
+    iter_chunks,
+    node_table,
+    unique_pairs,
+)
+from project.utils.storage import load_bm, save_bm
+
+DIRECTIONS = ("auto", "forward", "backward", "bidirectional")
+"""
+Directions of traversal of BFS-based Regular Path Querying.
+"""
+
+SELECTIVE_STATES = 8
+"""
+Maximum number of start or final states of a query which is cheaper to traverse from
+every such state separately.
+"""
 
 
 def tensor_rpq(
-    graph: MultiDiGraph,
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
     query: Regex,
     start_states: set = None,
     final_states: set = None,
+    strategy: str = "squaring",
+    policy: BackendPolicy | None = None,
+    lazy: bool = False,
+    from_sources: bool = False,
+    key: str | None = None,
 ) -> set:
     """
     Computes Regular Path Querying from given graph and regular expression
-    :param graph: Graph with labeled edges.
+    :param graph: Graph with labeled edges, its binary matrix or index, see cached_graph_index.
     :param query: Regular expression.
     :param start_states: Start states in graph. If None, then every node in graph is the starting.
     :param final_states: Final states in graph. If None, then every node in graph is the final.
+    :param strategy: Strategy of transitive closure computation, see CLOSURE_STRATEGIES.
+    :param policy: Policy to choose matrix backends. If None, then CSR matrices are used.
+    :param lazy: Enable to traverse intersection without building Kronecker products.
+        Closure rows are computed for start product states only, strategy and policy are ignored.
+    :param from_sources: Enable to propagate reachability only from start product states
+        instead of computing all-pairs closure, strategy is ignored.
+    :param key: Key of graph in the cache of query engines, see cached_graph_index.
+        If None, then graph is not cached.
     :return: Regular Path Querying
     """
-    graph_bm = bm_by_nfa(nfa_by_graph(graph, start_states, final_states))
-    query_bm = bm_by_nfa(dfa_by_regex(query))
+    return set(
+        chain.from_iterable(
+            iter_tensor_rpq(
+                graph,
+                query,
+                start_states,
+                final_states,
+                strategy,
+                policy,
+                lazy,
+                from_sources,
+                key=key,
+            )
+        )
+    )
+
 
+def iter_tensor_rpq(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    strategy: str = "squaring",
+    policy: BackendPolicy | None = None,
+    lazy: bool = False,
+    from_sources: bool = False,
+    batch_size: int = DEFAULT_CHUNK_SIZE,
+    key: str | None = None,
+):
+    """
+    Computes Regular Path Querying like tensor_rpq, but decodes unique pairs of nodes
+    from result index arrays lazily.
+
+    :param batch_size: Maximum number of pairs in one yielded list.
+    :return: Generator of lists of pairs of nodes.
+    """
+    result = tensor_rpq_indices(
+        graph,
+        query,
+        start_states,
+        final_states,
+        strategy,
+        policy,
+        lazy,
+        from_sources,
+        key,
+    )
+    yield from iter_chunks(*result, chunk_size=batch_size)
+
+
+def tensor_rpq_indices(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    strategy: str = "squaring",
+    policy: BackendPolicy | None = None,
+    lazy: bool = False,
+    from_sources: bool = False,
+    key: str | None = None,
+) -> IndexResult:
+    """
+    Computes Regular Path Querying like tensor_rpq, but returns unique pairs of nodes
+    as index arrays without creating Python objects per pair.
+
+    :return: Answers with indices of nodes in graph binary matrix.
+    """
+    query_bm = compile_regex(query).bm
+    graph_bm = cached_graph_index(graph, start_states, final_states, key).bm(
+        query_bm.matrix
+    )
+    nodes = node_table(st.value for st in graph_bm.states)
+    if lazy:
+        beg_nodes, end_nodes = _lazy_tensor_rpq(graph_bm, query_bm)
+        return IndexResult(nodes, *unique_pairs(beg_nodes, end_nodes, len(nodes)))
+    if policy is not None:
+        graph_bm = bm_with_backend(graph_bm, policy)
+        query_bm = bm_with_backend(query_bm, policy)
+
+    # Product state of graph state i and query state j has index i * k + j
+    k = len(query_bm.states)
     intersection = intersect(graph_bm, query_bm)
-    tc = transitive_closure(intersection)
-    res = set()
-    for n_from_i, n_to_i in zip(*tc):
-        n_from = intersection.states[n_from_i]
-        n_to = intersection.states[n_to_i]
-        if n_from.is_start and n_to.is_final:
-            beg_node = n_from.value[0]
-            end_node = n_to.value[0]
-            res.add((beg_node, end_node))
+    if from_sources:
+        rows, cols = _sources_tensor_rpq(intersection)
+    else:
+        starts = np.array([st.is_start for st in intersection.states], dtype=bool)
+        rows, cols = map(
+            np.asarray,
+            transitive_closure(
+                intersection, strategy, policy, rows=np.flatnonzero(starts)
+            ),
+        )
+        finals = np.array([st.is_final for st in intersection.states], dtype=bool)
+        answers = starts[rows] & finals[cols]
+        rows, cols = rows[answers], cols[answers]
+
+    return IndexResult(nodes, *unique_pairs(rows // k, cols // k, len(nodes)))
+
+
+def _lazy_tensor_rpq(graph_bm: BinaryMatrix, query_bm: BinaryMatrix) -> tuple:
+    intersection = LazyIntersection(graph_bm, query_bm)
+    sources = intersection.start_indices()
+    rows, cols = lazy_transitive_closure(intersection, sources).nonzero()
+
+    finals = intersection.is_final(cols)
+    beg_nodes, _ = intersection.split(sources[rows[finals]])
+    end_nodes, _ = intersection.split(cols[finals])
+
+    return beg_nodes, end_nodes
 
-    return res
+
+def _sources_tensor_rpq(intersection: BinaryMatrix) -> tuple:
+    sources = np.array(
+        [i for i, st in enumerate(intersection.states) if st.is_start], dtype=np.int64
+    )
+    finals = np.array([st.is_final for st in intersection.states], dtype=bool)
+    rows, cols = sources_transitive_closure(intersection, sources).nonzero()
+
+    return sources[rows[finals[cols]]], cols[finals[cols]]
 
 
 def _init_front(
     graph_states: list,
     query_states: list,
-    start_row: lil_array,
+    start_indexes: np.ndarray,
 ) -> csr_array:
-    x = len(query_states)
-    y = len(query_states) + len(graph_states)
-    f = lil_array((x, y), dtype=bool)
-    for i, st in enumerate(query_states):
-        if st.is_start:
-            f[i, i] = True
-            f[i, x:] = start_row
+    k = len(query_states)
+    query_starts = np.flatnonzero([st.is_start for st in query_states])
+    rows = np.concatenate([query_starts, np.repeat(query_starts, len(start_indexes))])
+    cols = np.concatenate([query_starts, np.tile(start_indexes, len(query_starts)) + k])
 
-    return f.tocsr()
+    return csr_by_coo(rows, cols, (k, k + len(graph_states)))
 
 
 def _init_front_separated(
     graph_states: list,
     query_states: list,
-    start_indexes: list,
+    start_indexes: np.ndarray,
 ) -> csr_array:
-    x = len(query_states)
-    y = len(graph_states)
-    fs = [
-        _init_front(
-            graph_states,
-            query_states,
-            lil_array([i == st_i for i in range(y)], dtype=bool),
-        )
-        for st_i in start_indexes
-    ]
+    k = len(query_states)
+    query_starts = np.flatnonzero([st.is_start for st in query_states])
+    # Block of k rows per start graph state
+    rows = np.add.outer(np.arange(len(start_indexes)) * k, query_starts).ravel()
+    cols = np.concatenate(
+        [
+            np.tile(query_starts, len(start_indexes)),
+            np.repeat(start_indexes, len(query_starts)) + k,
+        ]
+    )
 
-    return csr_array(vstack(fs)) if len(fs) else csr_array((x, x + y), dtype=bool)
+    return csr_by_coo(
+        np.concatenate([rows, rows]),
+        cols,
+        (len(start_indexes) * k, k + len(graph_states)),
+    )
 
 
 def _transform_front_part(
     k: int,
     front: csr_array,
 ) -> csr_array:
-    result = lil_array(front.shape, dtype=bool)
-    for i, j in zip(*front.nonzero()):
-        if j < k:
-            non_zero_row_right = front.getrow(i).tolil()[[0], k:]
-            if non_zero_row_right.nnz > 0:
-                row_shift = i // k * k
-                result[row_shift + j, j] = True
-                result[[row_shift + j], k:] += non_zero_row_right
+    """
+    Moves graph part of every row having query state j into row j of its block of k rows
+    and marks query state j on the diagonal of the block.
+    Rows without graph states are dropped.
+    """
+    m = front.shape[0]
+    graph_part = front[:, k:]
+    rows, cols = front[:, :k].nonzero()
+    rows, cols = rows.astype(np.int64), cols.astype(np.int64)
+    has_graph = np.diff(graph_part.indptr) > 0
+    rows, cols = rows[has_graph[rows]], cols[has_graph[rows]]
+    targets = rows // k * k + cols
+
+    # Block permutation ORs graph parts of rows moved to the same target
+    moved = csr_by_coo(targets, rows, (m, m)) @ graph_part
+    return csr_array(
+        hstack([csr_by_coo(targets, cols, (m, k)), moved], format="csr"), dtype=bool
+    )
+
+
+def _bfs_answers(
+    graph_bm: BinaryMatrix,
+    query_bm: BinaryMatrix,
+    front: csr_array,
+) -> csr_array:
+    """
+    Finds answers in front: final graph states of rows with final query states.
+
+    :return: Boolean matrix of answers with a row per block of k front rows.
+    """
+    k = len(query_bm.states)
+    query_finals = np.array([st.is_final for st in query_bm.states], dtype=bool)
+    graph_finals = np.array([st.is_final for st in graph_bm.states], dtype=bool)
+    rows, cols = front[:, k:].nonzero()
+    finals = query_finals[rows % k] & graph_finals[cols]
+
+    return csr_by_coo(
+        rows[finals] // k, cols[finals], (front.shape[0] // k, len(graph_bm.states))
+    )
+
+
+def _bfs_levels(graph_bm: BinaryMatrix, query_bm: BinaryMatrix, init_front: csr_array):
+    """
+    Traverses product of graph and query from initial front level by level.
+
+    :return: Generator of pairs of states first visited on a level and all states
+        visited so far, both in form of front.
+    """
+    k = len(query_bm.states)
+    # Front is multiplied by direct sum of query and graph matrices block by block,
+    # labels of only one of them do not move query part of front
+    steps = [
+        (SPARSE.convert(query_bm.matrix[label]), SPARSE.convert(m))
+        for label, m in graph_bm.matrix.items()
+        if label in query_bm.matrix
+    ]
+    # Only rows reached on previous step are propagated, every row keeps its query
+    # state on the diagonal of its block to be moved by the query part
+    front = init_front
+    visited = csr_array(init_front.shape, dtype=bool)
+    while front.nnz:
+        reached = csr_array(init_front.shape, dtype=bool)
+        for query_m, graph_m in steps:
+            front_part = hstack(
+                [
+                    parallel_matmul(front[:, :k], query_m),
+                    parallel_matmul(front[:, k:], graph_m),
+                ],
+                format="csr",
+            )
+            reached += _transform_front_part(k, front_part)
+
+        front = reached > visited
+        visited = visited + front
+        yield front, visited
+        rows = np.flatnonzero(np.diff(front.indptr))
+        front = front + csr_by_coo(rows, rows % k, front.shape)
+
+
+def _bfs_pairs(
+    graph_bm: BinaryMatrix,
+    query_bm: BinaryMatrix,
+    start_indexes: np.ndarray,
+    separated: bool,
+    limit: int | None = None,
+) -> tuple:
+    init_front = (_init_front_separated if separated else _init_front)(
+        graph_bm.states, query_bm.states, start_indexes
+    )
+
+    visited = csr_array(init_front.shape, dtype=bool)
+    answers = _bfs_answers(graph_bm, query_bm, visited)
+    for front, visited in _bfs_levels(graph_bm, query_bm, init_front):
+        if limit is not None:
+            # Answers only appear in new states, so traversal stops once enough found
+            answers += _bfs_answers(graph_bm, query_bm, front)
+            if answers.nnz >= limit:
+                break
+
+    if limit is None:
+        answers = _bfs_answers(graph_bm, query_bm, visited)
+    rows, cols = answers.nonzero()
+    rows, cols = rows[:limit], cols[:limit]
+
+    return start_indexes[rows] if separated else None, cols
+
+
+def _product_states(k: int, n: int, front: csr_array) -> csr_array:
+    """
+    Flattens front into matrix of product states (i, j) with indices i * k + j,
+    a row per block of k front rows.
+    """
+    rows, cols = front[:, k:].nonzero()
+    return csr_by_coo(rows // k, cols * k + rows % k, (front.shape[0] // k, n * k))
+
+
+def _bidirectional_pairs(
+    graph_bm: BinaryMatrix,
+    reversed_graph_bm: BinaryMatrix,
+    query_bm: BinaryMatrix,
+    start_indexes: np.ndarray,
+    final_indexes: np.ndarray,
+    limit: int | None = None,
+) -> tuple:
+    """
+    Finds pairs of start and final states by forward BFS from start states and
+    backward BFS from final states over reversed graph and query. The side with the
+    smaller front is advanced, a pair is found once its traversals meet in a product
+    state visited by a non-empty path of one of them. Traversal stops when all pairs
+    or limit of them are found or one of the sides is exhausted.
+    """
+    k = len(query_bm.states)
+    n = len(graph_bm.states)
+    target = len(start_indexes) * len(final_indexes)
+    if limit is not None:
+        target = min(target, limit)
+
+    sides = []
+    for side_graph_bm, side_query_bm, indexes in (
+        (graph_bm, query_bm, start_indexes),
+        (reversed_graph_bm, reversed_bm(query_bm), final_indexes),
+    ):
+        init_front = _init_front_separated(
+            side_graph_bm.states, side_query_bm.states, indexes
+        )
+        roots = _product_states(k, n, init_front)
+        sides.append(
+            {
+                "levels": _bfs_levels(side_graph_bm, side_query_bm, init_front),
+                "roots": roots,
+                "visited": csr_array(roots.shape, dtype=bool),
+                "front": roots.nnz,
+                "done": False,
+            }
+        )
+
+    forward, backward = sides
+    while True:
+        meet = csr_array(
+            forward["visited"] @ (backward["roots"] + backward["visited"]).T
+            + (forward["roots"] + forward["visited"]) @ backward["visited"].T,
+            dtype=bool,
+        )
+        if meet.nnz >= target or forward["done"] or backward["done"]:
+            break
+
+        side = min(sides, key=lambda s: s["front"])
+        level = next(side["levels"], None)
+        if level is None:
+            side["done"] = True
+        else:
+            front, visited = level
+            side["front"] = front.nnz
+            side["visited"] = _product_states(k, n, visited)
+
+    rows, cols = meet.nonzero()
+    rows, cols = rows[:limit], cols[:limit]
+
+    return start_indexes[rows], final_indexes[cols]
+
+
+_worker_bms = None
+
+
+def _init_bfs_worker(graph_path, query_bm: BinaryMatrix):
+    global _worker_bms
+    _worker_bms = load_bm(graph_path), query_bm
+
+
+def _bfs_worker(start_indexes: np.ndarray, separated: bool, limit: int | None) -> tuple:
+    return _bfs_pairs(*_worker_bms, start_indexes, separated, limit)
+
+
+def _bfs_chunks(
+    graph_bm: BinaryMatrix,
+    query_bm: BinaryMatrix,
+    chunks: list,
+    separated: bool,
+    processes: int,
+    limit: int | None = None,
+):
+    if processes == 1:
+        for chunk in chunks:
+            yield _bfs_pairs(graph_bm, query_bm, chunk, separated, limit)
+        return
+
+    # Workers map the same saved graph matrix into memory instead of copying it
+    with TemporaryDirectory() as tmp, ProcessPoolExecutor(
+        processes,
+        initializer=_init_bfs_worker,
+        initargs=(save_bm(graph_bm, tmp), query_bm),
+    ) as executor:
+        yield from executor.map(
+            partial(_bfs_worker, separated=separated, limit=limit), chunks
+        )
 
-    return result.tocsr()
+
+def _limited(results, limit: int, n: int, separated: bool):
+    """
+    Stops results of chunks once limit of unique answers is reached, the rest chunks
+    are not traversed.
+    """
+    seen = np.zeros(n, dtype=bool)
+    count = 0
+    try:
+        for starts, ends in results:
+            if not separated:
+                # End nodes of different chunks may repeat
+                ends = np.unique(ends)
+                ends = ends[~seen[ends]]
+                seen[ends] = True
+            else:
+                starts = starts[: limit - count]
+            ends = ends[: limit - count]
+            count += len(ends)
+            yield starts, ends
+            if count >= limit:
+                return
+    finally:
+        results.close()
 
 
 def bfs_rpq(
-    graph: MultiDiGraph,
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
     query: Regex,
     start_states: set = None,
     final_states: set = None,
     separated: bool = False,
+    chunk_size: int | None = None,
+    processes: int = 1,
+    limit: int | None = None,
+    direction: str = "auto",
+    key: str | None = None,
 ) -> set:
     """
     Computes Regular Path Querying from given graph and regular expression
-    :param graph: Graph with labeled edges.
+    :param graph: Graph with labeled edges, its binary matrix or index, see cached_graph_index.
     :param query: Regular expression.
     :param start_states: Start states in graph. If None, then every node in graph is the starting.
     :param final_states: Final states in graph. If None, then every node in graph is the final.
     :param separated: Enable to find the initial state.
+    :param chunk_size: Number of start states of one BFS, so front has at most
+        chunk_size blocks of query states. If None, then all start states are traversed at once.
+    :param processes: Number of worker processes traversing chunks. Workers share graph
+        matrix saved into temporary directory and mapped into memory.
+    :param limit: Maximum number of answers. If given, then traversal stops as soon as
+        limit answers are found. If None, then all answers are found.
+    :param direction: One of DIRECTIONS. Backward traversal starts from every final
+        state over reversed graph and query, chunks are chunks of final states then.
+        Bidirectional traversal meets forward and backward ones and ignores chunks.
+        If "auto", then direction is chosen by numbers of start and final states.
+    :param key: Key of graph in the cache of query engines, see cached_graph_index.
+        If None, then graph is not cached.
     :return: Regular Path Querying
+    :raises ValueError: if chunk size, number of processes or limit is not positive
+        or direction is unknown.
     """
+    return set(
+        chain.from_iterable(
+            iter_bfs_rpq(
+                graph,
+                query,
+                start_states,
+                final_states,
+                separated,
+                chunk_size,
+                processes,
+                limit=limit,
+                direction=direction,
+                key=key,
+            )
+        )
+    )
 
-    graph_bm = bm_by_nfa(nfa_by_graph(graph, start_states, final_states))
-    query_bm = bm_by_nfa(dfa_by_regex(query))
 
-    n = len(graph_bm.states)
-    k = len(query_bm.states)
+def bfs_rpq_exists(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    chunk_size: int | None = None,
+    processes: int = 1,
+    direction: str = "auto",
+    key: str | None = None,
+) -> bool:
+    """
+    Checks whether some path from a start state to a final state matches regular
+    expression. Traversal stops as soon as the first final product state is reached.
 
-    if not n:
-        return set()
+    :param graph: Graph with labeled edges, its binary matrix or index, see cached_graph_index.
+    :param query: Regular expression.
+    :param start_states: Start states in graph. If None, then every node in graph is the starting.
+    :param final_states: Final states in graph. If None, then every node in graph is the final.
+    :param chunk_size: Number of start states of one BFS, see bfs_rpq.
+    :param processes: Number of worker processes traversing chunks, see bfs_rpq.
+    :param direction: Direction of traversal, see bfs_rpq.
+    :param key: Key of graph in the cache of query engines, see bfs_rpq.
+    :return: True if Regular Path Querying is not empty.
+    :raises ValueError: if chunk size or number of processes is not positive
+        or direction is unknown.
+    """
+    result = bfs_rpq_indices(
+        graph,
+        query,
+        start_states,
+        final_states,
+        False,
+        chunk_size,
+        processes,
+        1,
+        direction,
+        key,
+    )
+    return len(result.rows) > 0
 
-    start_graph_indices = [i for i, st in enumerate(graph_bm.states) if st.is_start]
 
-    init_front = (
-        _init_front(
-            graph_bm.states,
-            query_bm.states,
-            lil_array([st.is_start for st in graph_bm.states], dtype=bool),
+def iter_bfs_rpq(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    separated: bool = False,
+    chunk_size: int | None = None,
+    processes: int = 1,
+    batch_size: int = DEFAULT_CHUNK_SIZE,
+    limit: int | None = None,
+    direction: str = "auto",
+    key: str | None = None,
+):
+    """
+    Computes Regular Path Querying like bfs_rpq, but decodes unique answers from result
+    index arrays lazily. Separated answers of every chunk of start states are yielded
+    as soon as the chunk is traversed.
+
+    :param batch_size: Maximum number of answers in one yielded list.
+    :return: Generator of lists of pairs of nodes if separated, otherwise of lists of nodes.
+    """
+    if not separated:
+        result = bfs_rpq_indices(
+            graph,
+            query,
+            start_states,
+            final_states,
+            False,
+            chunk_size,
+            processes,
+            limit,
+            direction,
+            key,
         )
-        if not separated
-        else _init_front_separated(
-            graph_bm.states, query_bm.states, start_graph_indices
+        yield from iter_chunks(*result, chunk_size=batch_size)
+        return
+
+    nodes, results = _bfs_rpq_chunks(
+        graph,
+        query,
+        start_states,
+        final_states,
+        True,
+        chunk_size,
+        processes,
+        limit,
+        direction,
+        key,
+    )
+    for starts, ends in results:
+        yield from iter_chunks(nodes, starts, ends, batch_size)
+
+
+def bfs_rpq_indices(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    separated: bool = False,
+    chunk_size: int | None = None,
+    processes: int = 1,
+    limit: int | None = None,
+    direction: str = "auto",
+    key: str | None = None,
+) -> IndexResult:
+    """
+    Computes Regular Path Querying like bfs_rpq, but returns unique answers as index
+    arrays without creating Python objects per answer.
+
+    :return: Answers with indices of nodes in graph binary matrix, answers are single
+        nodes if not separated.
+    """
+    nodes, results = _bfs_rpq_chunks(
+        graph,
+        query,
+        start_states,
+        final_states,
+        separated,
+        chunk_size,
+        processes,
+        limit,
+        direction,
+        key,
+    )
+    empty = np.array([], dtype=np.int64)
+    results = list(results)
+    ends = np.concatenate([empty, *(ends for _, ends in results)])
+    if separated:
+        starts = np.concatenate([empty, *(starts for starts, _ in results)])
+        return IndexResult(nodes, starts, ends)
+    return IndexResult(nodes, np.unique(ends), None)
+
+
+def _bfs_direction(direction: str, starts: int, finals: int, separated: bool) -> str:
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown direction: {direction}")
+    if direction != "auto":
+        return direction
+    if separated and max(starts, finals) <= SELECTIVE_STATES:
+        return "bidirectional"
+    # Backward traversal has a block per final state even if not separated
+    if finals < starts and (separated or finals <= SELECTIVE_STATES):
+        return "backward"
+    return "forward"
+
+
+def _bidirectional_chunks(
+    graph_bm: BinaryMatrix,
+    reversed_graph_bm: BinaryMatrix,
+    query_bm: BinaryMatrix,
+    start_indexes: np.ndarray,
+    final_indexes: np.ndarray,
+    separated: bool,
+    limit: int | None,
+):
+    if not separated:
+        # Pairs with the same final state would be counted by limit separately
+        _, ends = _bidirectional_pairs(
+            graph_bm, reversed_graph_bm, query_bm, start_indexes, final_indexes
         )
+        yield None, np.unique(ends)
+        return
+    yield _bidirectional_pairs(
+        graph_bm, reversed_graph_bm, query_bm, start_indexes, final_indexes, limit
     )
 
-    visited = csr_array(init_front.shape, dtype=bool)
-    ds = direct_sum(query_bm, graph_bm)
-    while True:
-        prev_nnz = visited.nnz
 
-        for tmp in ds.matrix.values():
-            front_part = visited @ tmp if init_front is None else init_front @ tmp
-            visited += _transform_front_part(len(query_bm.states), front_part)
+def _bfs_rpq_chunks(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set | None,
+    final_states: set | None,
+    separated: bool,
+    chunk_size: int | None,
+    processes: int,
+    limit: int | None = None,
+    direction: str = "auto",
+    key: str | None = None,
+) -> tuple:
+    if chunk_size is not None and chunk_size < 1:
+        raise ValueError(f"Invalid chunk size: {chunk_size}")
+    if processes < 1:
+        raise ValueError(f"Invalid number of processes: {processes}")
+    if limit is not None and limit < 1:
+        raise ValueError(f"Invalid limit: {limit}")
+
+    index = cached_graph_index(graph, start_states, final_states, key)
+    query_bm = compile_regex(query).bm
+    graph_bm = index.bm(query_bm.matrix)
+    nodes = node_table(st.value for st in graph_bm.states)
+    start_indexes = np.flatnonzero([st.is_start for st in graph_bm.states])
+    final_indexes = np.flatnonzero([st.is_final for st in graph_bm.states])
+    direction = _bfs_direction(
+        direction, len(start_indexes), len(final_indexes), separated
+    )
+    if not nodes.size:
+        return nodes, iter(())
+
+    if direction == "bidirectional":
+        results = _bidirectional_chunks(
+            graph_bm,
+            index.reversed_bm(query_bm.matrix),
+            query_bm,
+            start_indexes,
+            final_indexes,
+            separated,
+            limit,
+        )
+    elif direction == "backward":
+        # Final states are traversed separately over reversed graph and query,
+        # states reached from them are start states of answers
+        chunk_size = chunk_size or max(len(final_indexes), 1)
+        chunks = [
+            final_indexes[beg : beg + chunk_size]
+            for beg in range(0, len(final_indexes), chunk_size)
+        ]
+        results = _bfs_chunks(
+            index.reversed_bm(query_bm.matrix),
+            reversed_bm(query_bm),
+            chunks,
+            True,
+            processes,
+            limit if separated else None,
+        )
+        if separated:
+            results = (unique_pairs(s, e, len(nodes)) for e, s in results)
+        else:
+            results = ((None, np.unique(e)) for e, _ in results)
+    else:
+        chunk_size = chunk_size or max(len(start_indexes), 1)
+        chunks = [
+            start_indexes[beg : beg + chunk_size]
+            for beg in range(0, len(start_indexes), chunk_size)
+        ]
+        results = _bfs_chunks(graph_bm, query_bm, chunks, separated, processes, limit)
+        if separated:
+            # Chunks have disjoint start states, so their pairs never repeat
+            results = (unique_pairs(s, e, len(nodes)) for s, e in results)
 
-        init_front = None
+    if limit is not None:
+        results = _limited(results, limit, len(nodes), separated)
+    return nodes, results
+
+
+def _successors(graph_m: csr_array, rows: np.ndarray) -> tuple:
+    """
+    Finds all edges from given rows of CSR matrix.
+
+    :return: Positions of edge sources in rows and edge targets.
+    """
+    beg, end = graph_m.indptr[rows], graph_m.indptr[rows + 1]
+    counts = end - beg
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(np.arange(len(rows)), counts)
+    return positions, graph_m.indices[np.repeat(beg, counts) + offsets]
 
-        if visited.nnz == prev_nnz:
-            break
 
-    res = set()
-    for i, j in zip(*visited.nonzero()):
-        if j >= k and query_bm.states[i % k].is_final:
-            g_st_index = j - k
-            if graph_bm.states[g_st_index].is_final:
-                res.add(
-                    g_st_index
-                    if not separated
-                    else (start_graph_indices[i // k], g_st_index)
-                )
-
-    return (
-        {(graph_bm.states[i].value, graph_bm.states[j].value) for i, j in res}
-        if separated
-        else {graph_bm.states[i].value for i in res}
+def witness_paths(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    query: Regex,
+    start_states: set = None,
+    final_states: set = None,
+    pairs: set = None,
+    key: str | None = None,
+) -> dict:
+    """
+    Finds a shortest labeled path for every answer of Regular Path Querying.
+    Product automaton is traversed by BFS from every start node separately, parent
+    product state and label of every visited state are kept in integer arrays.
+
+    :param graph: Graph with labeled edges, its binary matrix or index, see cached_graph_index.
+    :param query: Regular expression.
+    :param start_states: Start states in graph. If None, then every node in graph is the starting.
+    :param final_states: Final states in graph. If None, then every node in graph is the final.
+    :param pairs: Answers to find paths for. If None, then paths for all answers are found.
+    :param key: Key of graph in the cache of query engines, see tensor_rpq.
+    :return: Dictionary of answer pairs of nodes to lists of (node from, label, node to)
+        edges of their paths.
+    """
+    query_bm = compile_regex(query).bm
+    graph_bm = cached_graph_index(graph, start_states, final_states, key).bm(
+        query_bm.matrix
     )
+    nodes = [st.value for st in graph_bm.states]
+    k = len(query_bm.states)
+    n = len(nodes)
+
+    # Minimal DFA has at most one transition by label from every state
+    labels = [label for label in graph_bm.matrix if label in query_bm.matrix]
+    steps = []
+    for label in labels:
+        delta = np.full(k, -1, dtype=np.int64)
+        rows, cols = SPARSE.convert(query_bm.matrix[label]).nonzero()
+        delta[rows] = cols
+        steps.append((SPARSE.convert(graph_bm.matrix[label]), delta))
+
+    query_roots = np.flatnonzero([st.is_start for st in query_bm.states])
+    is_final = np.logical_and.outer(
+        [st.is_final for st in graph_bm.states],
+        [st.is_final for st in query_bm.states],
+    ).ravel()
+
+    if pairs is None:
+        targets = {i: None for i, st in enumerate(graph_bm.states) if st.is_start}
+    else:
+        index = {node: i for i, node in enumerate(nodes)}
+        targets = {}
+        for beg, end in pairs:
+            if beg in index and end in index and graph_bm.states[index[beg]].is_start:
+                targets.setdefault(index[beg], set()).add(index[end])
+
+    parent = np.full(n * k, -1, dtype=np.int64)
+    parent_label = np.zeros(n * k, dtype=np.int32)
+    is_root = np.zeros(n * k, dtype=bool)
+    res = {}
+    for beg, ends in targets.items():
+        roots = beg * k + query_roots
+        is_root[roots] = True
+        visited = []
+        found = {}
+
+        front = roots
+        while len(front) and (ends is None or len(found) < len(ends)):
+            next_front = []
+            for label_id, (graph_m, delta) in enumerate(steps):
+                q = delta[front % k]
+                xs, q = front[q >= 0], q[q >= 0]
+                positions, graph_ys = _successors(graph_m, xs // k)
+                ys, first = np.unique(graph_ys * k + q[positions], return_index=True)
+                new = parent[ys] < 0
+                ys = ys[new]
+                parent[ys] = xs[positions[first[new]]]
+                parent_label[ys] = label_id
+                next_front.append(ys)
+            front = np.concatenate([roots[:0], *next_front])
+            visited.append(front)
+
+            finals = front[is_final[front]]
+            graph_ends, first = np.unique(finals // k, return_index=True)
+            for end, y in zip(graph_ends.tolist(), finals[first].tolist()):
+                if end not in found and (ends is None or end in ends):
+                    found[end] = y
+
+        for end, y in found.items():
+            path = []
+            while True:
+                x = parent[y]
+                path.append((nodes[x // k], labels[parent_label[y]], nodes[y // k]))
+                y = x
+                if is_root[y]:
+                    break
+            res[(nodes[beg], nodes[end])] = path[::-1]
+
+        for states in visited:
+            parent[states] = -1
+        is_root[roots] = False
+
+    return res
+
+
+def batch_rpq(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    queries: list,
+    start_states: set = None,
+    final_states: set = None,
+    chunk_size: int | None = None,
+    key: str | None = None,
+) -> list:
+    """
+    Computes Regular Path Querying for many regular expressions over one graph at once.
+    Query DFAs are combined into one automaton, their disjoint union, so graph matrices
+    are converted and multiplied once per step of one BFS for all queries, and answers
+    are split by automata owning reached final states.
+
+    :param graph: Graph with labeled edges, its binary matrix or index, see cached_graph_index.
+    :param queries: List of regular expressions.
+    :param start_states: Start states in graph. If None, then every node in graph is the starting.
+    :param final_states: Final states in graph. If None, then every node in graph is the final.
+    :param chunk_size: Number of start states of one BFS, see bfs_rpq.
+    :param key: Key of graph in the cache of query engines, see tensor_rpq.
+    :return: List of Regular Path Queryings of queries in their order.
+    :raises ValueError: if chunk size is not positive.
+    """
+    return [
+        {pair for chunk in iter_chunks(*result) for pair in chunk}
+        for result in batch_rpq_indices(
+            graph, queries, start_states, final_states, chunk_size, key
+        )
+    ]
+
+
+def batch_rpq_indices(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    queries: list,
+    start_states: set = None,
+    final_states: set = None,
+    chunk_size: int | None = None,
+    key: str | None = None,
+) -> list:
+    """
+    Computes Regular Path Querying like batch_rpq, but returns unique answers of every
+    query as index arrays without creating Python objects per answer.
+
+    :return: List of answers of queries with indices of nodes in graph binary matrix.
+    """
+    if chunk_size is not None and chunk_size < 1:
+        raise ValueError(f"Invalid chunk size: {chunk_size}")
+
+    query_bms = [compile_regex(query).bm for query in queries]
+    query_bm = disjoint_union(query_bms)
+    graph_bm = cached_graph_index(graph, start_states, final_states, key).bm(
+        query_bm.matrix
+    )
+    nodes = node_table(st.value for st in graph_bm.states)
+    n, k = len(nodes), len(query_bm.states)
+
+    owners = np.repeat(np.arange(len(query_bms)), [len(bm.states) for bm in query_bms])
+    query_finals = np.array([st.is_final for st in query_bm.states], dtype=bool)
+    graph_finals = np.array([st.is_final for st in graph_bm.states], dtype=bool)
+    start_indexes = np.flatnonzero([st.is_start for st in graph_bm.states])
+    chunk_size = chunk_size or max(len(start_indexes), 1)
+
+    # Answer of query q from node i to node j is encoded as (q * n + i) * n + j
+    keys = [np.array([], dtype=np.int64)]
+    for beg in range(0, len(start_indexes) if k else 0, chunk_size):
+        chunk = start_indexes[beg : beg + chunk_size]
+        init_front = _init_front_separated(graph_bm.states, query_bm.states, chunk)
+        visited = init_front[:0]
+        for _, visited in _bfs_levels(graph_bm, query_bm, init_front):
+            pass
+
+        rows, cols = visited[:, k:].nonzero()
+        finals = query_finals[rows % k] & graph_finals[cols]
+        rows, cols = rows[finals], cols[finals]
+        keys.append((owners[rows % k] * n + chunk[rows // k]) * n + cols)
+
+    keys = np.unique(np.concatenate(keys))
+    bounds = np.searchsorted(keys, np.arange(len(query_bms) + 1) * n * n)
+    return [
+        IndexResult(nodes, *np.divmod(keys[beg:end] % (n * n), n))
+        for beg, end in zip(bounds, bounds[1:])
+    ]
@@ -11,7 +11,8 @@ from project.interpretator.types.pair import GQLangPair
 from project.interpretator.types.set import GQLangSet
 from project.interpretator.types.triple import GQLangTriple
 from project.utils.automata import dfa_by_regex, nfa_by_graph, intersect_nfa
-from project.utils.binary_matrix import bm_by_nfa, transitive_closure
+from project.utils.binary_matrix import transitive_closure
+from project.utils.cache import cached_bm_by_nfa
 from project.utils.graph import get_graph
 
 
@@ -116,7 +117,7 @@ class GQLangFA(GQLangAutomata, ABC):
             GQLangPair(s.value, s.value)
             for s in self._nfa.start_states.intersection(self._nfa.final_states)
         )
-        bm = bm_by_nfa(self._nfa)
+        bm = cached_bm_by_nfa(self._nfa)
         for n_from_i, n_to_i in zip(*transitive_closure(bm)):
             n_from = bm.states[n_from_i]
             n_to = bm.states[n_to_i]
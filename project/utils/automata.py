@@ -26,6 +26,17 @@ def dfa_by_regex(regex: Regex) -> DeterministicFiniteAutomaton:
     return regex.to_epsilon_nfa().minimize()
 
 
+def _check_states(all_nodes: set, start_states: set | None, final_states: set | None):
+    if start_states and not start_states.issubset(all_nodes):
+        raise AutomataUtilsError(
+            f"Invalid start states: {start_states.difference(all_nodes)}"
+        )
+    if final_states and not final_states.issubset(all_nodes):
+        raise AutomataUtilsError(
+            f"Invalid final states: {final_states.difference(all_nodes)}"
+        )
+
+
 def nfa_by_graph(
     graph: MultiDiGraph, start_states: set = None, final_states: set = None
 ) -> NondeterministicFiniteAutomaton:
@@ -48,15 +59,7 @@ def nfa_by_graph(
         start_states = all_nodes
     if not final_states:
         final_states = all_nodes
-
-    if not start_states.issubset(all_nodes):
-        raise AutomataUtilsError(
-            f"Invalid start states: {start_states.difference(all_nodes)}"
-        )
-    if not final_states.issubset(all_nodes):
-        raise AutomataUtilsError(
-            f"Invalid final states: {final_states.difference(all_nodes)}"
-        )
+    _check_states(all_nodes, start_states, final_states)
 
     for state in start_states:
         nfa.add_start_state(State(state))
@@ -66,6 +69,54 @@ def nfa_by_graph(
     return nfa
 
 
+def bm_by_graph(
+    graph: MultiDiGraph | BinaryMatrix,
+    start_states: set = None,
+    final_states: set = None,
+) -> BinaryMatrix:
+    """
+    Builds binary matrix by a graph. Edges are grouped by label straight into matrices
+    without building NFA, states follow order of graph nodes. Binary matrix of a graph
+    built before, e.g. loaded by project.utils.storage.load_bm, is reused with given
+    start and final states.
+
+    :param graph: Graph or its binary matrix.
+    :param start_states: Start states in graph. If None, then every node in graph is the starting, or start flags of given binary matrix are kept.
+    :param final_states: Final states in graph. If None, then every node in graph is the final, or final flags of given binary matrix are kept.
+    :return: Binary matrix of graph.
+    :raises AutomataUtilsError: if the given starting or final states do not match the graph.
+    """
+    if not isinstance(graph, BinaryMatrix):
+        _check_states(set(graph), start_states, final_states)
+        states = [
+            StateInfo(
+                node,
+                not start_states or node in start_states,
+                not final_states or node in final_states,
+            )
+            for node in graph.nodes
+        ]
+        return bm_by_transitions(
+            states,
+            (
+                (n_from, label, n_to)
+                for n_from, n_to, label in graph.edges.data("label")
+                if label is not None
+            ),
+        )
+
+    _check_states({st.value for st in graph.states}, start_states, final_states)
+    states = [
+        StateInfo(
+            st.value,
+            st.value in start_states if start_states else st.is_start,
+            st.value in final_states if final_states else st.is_final,
+        )
+        for st in graph.states
+    ]
+    return BinaryMatrix(states, graph.matrix)
+
+
 def intersect_nfa(
     nfa1: NondeterministicFiniteAutomaton, nfa2: NondeterministicFiniteAutomaton
 ) -> NondeterministicFiniteAutomaton:
@@ -0,0 +1,299 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from scipy.sparse import csr_array, kron, block_diag, eye, issparse
+
+from project.utils.bit_matrix import BitMatrix
+from project.utils.parallel import parallel_matmul, parallel_matmul_add
+
+
+class MatrixBackend(ABC):
+    """
+    Storage and operations of boolean matrices of one representation.
+    Every operation accepts matrices of this backend only, use convert for others.
+    """
+
+    name: str
+
+    @abstractmethod
+    def owns(self, matrix) -> bool:
+        ...
+
+    @abstractmethod
+    def convert(self, matrix):
+        ...
+
+    @abstractmethod
+    def zeros(self, shape: tuple):
+        ...
+
+    @abstractmethod
+    def eye(self, n: int):
+        ...
+
+    @abstractmethod
+    def kron(self, a, b):
+        ...
+
+    @abstractmethod
+    def matmul(self, a, b):
+        ...
+
+    @abstractmethod
+    def add(self, a, b):
+        ...
+
+    @abstractmethod
+    def difference(self, a, b):
+        """
+        Cells set in a and unset in b.
+        """
+        ...
+
+    @abstractmethod
+    def nnz(self, matrix) -> int:
+        ...
+
+    @abstractmethod
+    def nonzero(self, matrix) -> tuple:
+        ...
+
+    @abstractmethod
+    def block_diag(self, a, b):
+        ...
+
+    def matmul_add(self, acc, a, b):
+        """
+        Computes ``acc + a @ b``.
+        """
+        return self.add(acc, self.matmul(a, b))
+
+    def __repr__(self):
+        return f"<{self.name} matrix backend>"
+
+
+class SparseBackend(MatrixBackend):
+    """
+    Boolean scipy CSR arrays. Products are computed by row blocks in parallel,
+    see project.utils.parallel.
+    """
+
+    name = "sparse"
+
+    def owns(self, matrix) -> bool:
+        return issparse(matrix)
+
+    def convert(self, matrix) -> csr_array:
+        if isinstance(matrix, BitMatrix):
+            return matrix.tocsr()
+        return csr_array(matrix, dtype=bool)
+
+    def zeros(self, shape: tuple) -> csr_array:
+        return csr_array(shape, dtype=bool)
+
+    def eye(self, n: int) -> csr_array:
+        return csr_array(eye(n, dtype=bool, format="csr"))
+
+    def kron(self, a, b) -> csr_array:
+        return csr_array(kron(a, b, format="csr"))
+
+    def matmul(self, a, b) -> csr_array:
+        return parallel_matmul(a, b)
+
+    def matmul_add(self, acc, a, b) -> csr_array:
+        return parallel_matmul_add(acc, a, b)
+
+    def add(self, a, b) -> csr_array:
+        res = a + b
+        res.eliminate_zeros()
+        return res
+
+    def difference(self, a, b) -> csr_array:
+        return a > b
+
+    def nnz(self, matrix) -> int:
+        return matrix.nnz
+
+    def nonzero(self, matrix) -> tuple:
+        return matrix.nonzero()
+
+    def block_diag(self, a, b) -> csr_array:
+        return csr_array(block_diag((a, b), format="csr", dtype=bool))
+
+
+class DenseBackend(MatrixBackend):
+    """
+    Boolean NumPy arrays.
+    """
+
+    name = "dense"
+
+    def owns(self, matrix) -> bool:
+        return isinstance(matrix, np.ndarray)
+
+    def convert(self, matrix) -> np.ndarray:
+        if isinstance(matrix, np.ndarray):
+            return matrix.astype(bool, copy=False)
+        return matrix.toarray().astype(bool, copy=False)
+
+    def zeros(self, shape: tuple) -> np.ndarray:
+        return np.zeros(shape, dtype=bool)
+
+    def eye(self, n: int) -> np.ndarray:
+        return np.eye(n, dtype=bool)
+
+    def kron(self, a, b) -> np.ndarray:
+        return np.kron(a, b)
+
+    def matmul(self, a, b) -> np.ndarray:
+        # Boolean NumPy matmul does not use BLAS, counts of paths in float32 are exact
+        # enough to be compared with zero
+        return (a.astype(np.float32) @ b.astype(np.float32)) > 0
+
+    def add(self, a, b) -> np.ndarray:
+        return a | b
+
+    def difference(self, a, b) -> np.ndarray:
+        return a & ~b
+
+    def nnz(self, matrix) -> int:
+        return int(np.count_nonzero(matrix))
+
+    def nonzero(self, matrix) -> tuple:
+        return np.nonzero(matrix)
+
+    def block_diag(self, a, b) -> np.ndarray:
+        res = np.zeros(np.add(a.shape, b.shape), dtype=bool)
+        res[: a.shape[0], : a.shape[1]] = a
+        res[a.shape[0] :, a.shape[1] :] = b
+        return res
+
+
+class BitBackend(MatrixBackend):
+    """
+    Bit-packed BitMatrix objects.
+    """
+
+    name = "bit"
+
+    def owns(self, matrix) -> bool:
+        return isinstance(matrix, BitMatrix)
+
+    def convert(self, matrix) -> BitMatrix:
+        if isinstance(matrix, BitMatrix):
+            return matrix
+        if isinstance(matrix, np.ndarray):
+            return BitMatrix.from_dense(matrix)
+        return BitMatrix.from_sparse(matrix)
+
+    def zeros(self, shape: tuple) -> BitMatrix:
+        return BitMatrix.zeros(shape)
+
+    def eye(self, n: int) -> BitMatrix:
+        return BitMatrix.eye(n)
+
+    def kron(self, a, b) -> BitMatrix:
+        return a.kron(b)
+
+    def matmul(self, a, b) -> BitMatrix:
+        return a @ b
+
+    def add(self, a, b) -> BitMatrix:
+        return a | b
+
+    def difference(self, a, b) -> BitMatrix:
+        return a > b
+
+    def nnz(self, matrix) -> int:
+        return matrix.nnz
+
+    def nonzero(self, matrix) -> tuple:
+        return matrix.nonzero()
+
+    def block_diag(self, a, b) -> BitMatrix:
+        return a.block_diag(b)
+
+
+SPARSE = SparseBackend()
+DENSE = DenseBackend()
+BIT = BitBackend()
+
+BACKENDS = {backend.name: backend for backend in (SPARSE, DENSE, BIT)}
+"""
+Available matrix backends by their names.
+"""
+
+
+def backend_of(matrix) -> MatrixBackend:
+    """
+    Finds backend owning given matrix.
+
+    :param matrix: Boolean matrix.
+    :return: Backend of matrix.
+    :raises TypeError: if matrix has unknown type.
+    """
+    for backend in (SPARSE, DENSE, BIT):
+        if backend.owns(matrix):
+            return backend
+    raise TypeError(f"Unknown boolean matrix type: {type(matrix)}")
+
+
+def common_backend(*matrices) -> MatrixBackend:
+    """
+    Finds backend to compute an operation on matrices of possibly different backends:
+    bit-packed, then dense, then sparse one.
+
+    :param matrices: Boolean matrices.
+    :return: Common backend, SPARSE if no matrices given.
+    """
+    backends = {backend_of(m) for m in matrices}
+    return next((b for b in (BIT, DENSE) if b in backends), SPARSE)
+
+
+def product_backend(*matrices) -> MatrixBackend:
+    """
+    Finds backend to compute Kronecker product or block diagonal of matrices. Density
+    of result does not exceed density of operands, so it is sparse if any operand is.
+
+    :param matrices: Boolean matrices.
+    :return: Backend of result.
+    """
+    if any(SPARSE.owns(m) for m in matrices):
+        return SPARSE
+    return common_backend(*matrices)
+
+
+class BackendPolicy:
+    """
+    Chooses backend of a matrix by its shape and density.
+    Sparse matrices are stored as CSR, denser ones as NumPy arrays while they are small
+    and as bit-packed matrices otherwise. Products of bit-packed matrices are faster
+    than products of NumPy arrays beyond a few hundred rows.
+
+    :param sparse_density: Maximum density of matrix stored as CSR.
+    :param dense_cells: Maximum number of cells of matrix stored as NumPy array.
+    """
+
+    def __init__(self, sparse_density: float = 0.02, dense_cells: int = 1 << 16):
+        self.sparse_density = sparse_density
+        self.dense_cells = dense_cells
+
+    def choose(self, shape: tuple, nnz: int) -> MatrixBackend:
+        cells = shape[0] * shape[1]
+        if cells == 0 or nnz <= self.sparse_density * cells:
+            return SPARSE
+        return DENSE if cells <= self.dense_cells else BIT
+
+    def adapt(self, matrix):
+        """
+        Converts matrix to the chosen backend if it is stored by another one.
+        Used inside fixpoint loops to switch representation when density grows.
+        """
+        backend = backend_of(matrix)
+        chosen = self.choose(matrix.shape, backend.nnz(matrix))
+        return matrix if chosen is backend else chosen.convert(matrix)
+
+
+AUTO = BackendPolicy()
+"""
+Default backend policy.
+"""
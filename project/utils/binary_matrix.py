@@ -1,16 +1,118 @@
 from collections import namedtuple
 from itertools import product
+import numpy as np
 from pyformlang.finite_automaton import NondeterministicFiniteAutomaton, State
-from scipy.sparse import kron, dok_array, csr_array, bmat
+from scipy.sparse import block_diag, csr_array
+
+from project.utils.backend import (
+    BIT,
+    SPARSE,
+    BackendPolicy,
+    MatrixBackend,
+    backend_of,
+    common_backend,
+    product_backend,
+)
+from project.utils.scc import scc_closure, expand_scc_closure
 
 BinaryMatrix = namedtuple("BinaryMatrix", "states matrix")
 """
 Namedtuple specifying a binary matrix for some automaton.
+Matrices of labels are stored by any backend of project.utils.backend: boolean scipy
+CSR arrays, boolean NumPy arrays or bit-packed BitMatrix objects.
 """
 
 StateInfo = namedtuple("StateInfo", "value is_start is_final")
 
 
+def csr_by_coo(rows, cols, n: int | tuple) -> csr_array:
+    """
+    Builds boolean CSR matrix by coordinates of its nonzero cells in one call.
+
+    :param rows: Row indices of nonzero cells.
+    :param cols: Column indices of nonzero cells.
+    :param n: Size of square matrix or shape of matrix.
+    :return: Boolean CSR matrix.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    shape = n if isinstance(n, tuple) else (n, n)
+    matrix = csr_array(
+        (np.ones(len(rows), dtype=bool), (rows, cols)), shape=shape, dtype=bool
+    )
+    matrix.sum_duplicates()
+    return matrix
+
+
+def bm_by_transitions(states: list, transitions) -> BinaryMatrix:
+    """
+    Builds binary matrix by states and labeled transitions between them.
+    Every state is interned into its index once and transitions are grouped by label
+    into COO arrays, so building takes linear time in the number of transitions.
+
+    :param states: States of binary matrix.
+    :param transitions: Iterable of triplets (value_from, label, value_to) of state values.
+    :return: Binary matrix.
+    """
+    index = {st.value: i for i, st in enumerate(states)}
+
+    coo = {}
+    for n_from, label, n_to in transitions:
+        rows, cols = coo.setdefault(label, ([], []))
+        rows.append(index[n_from])
+        cols.append(index[n_to])
+
+    matrix = {
+        label: csr_by_coo(rows, cols, len(states))
+        for label, (rows, cols) in coo.items()
+    }
+
+    return BinaryMatrix(states, matrix)
+
+
+def iter_nfa_transitions(nfa: NondeterministicFiniteAutomaton):
+    """
+    Iterates over all transitions of NFA.
+
+    :param nfa: NFA to iterate.
+    :return: Iterator of triplets (value_from, label, value_to).
+    """
+    transitions = nfa.to_dict()
+    for n_from in transitions:
+        for symbol, ns_to in transitions[n_from].items():
+            for n_to in ns_to if isinstance(ns_to, set) else {ns_to}:
+                yield n_from.value, symbol.value, n_to.value
+
+
+def bm_with_backend(
+    bm: BinaryMatrix, backend: MatrixBackend | BackendPolicy
+) -> BinaryMatrix:
+    """
+    Converts matrices of all labels of binary matrix to given backend.
+
+    :param bm: Binary matrix to convert.
+    :param backend: Backend to convert to or policy choosing it for every matrix.
+    :return: Binary matrix with converted matrices.
+    """
+    if isinstance(backend, BackendPolicy):
+        return BinaryMatrix(
+            bm.states, {label: backend.adapt(m) for label, m in bm.matrix.items()}
+        )
+    return BinaryMatrix(
+        bm.states, {label: backend.convert(m) for label, m in bm.matrix.items()}
+    )
+
+
+def bit_packed_bm(bm: BinaryMatrix) -> BinaryMatrix:
+    """
+    Converts matrices of all labels of binary matrix to bit-packed form.
+
+    :param bm: Binary matrix to convert.
+    :return: Binary matrix with BitMatrix matrices.
+    """
+    return bm_with_backend(bm, BIT)
+
+
 def bm_by_nfa(nfa: NondeterministicFiniteAutomaton) -> BinaryMatrix:
     """
     Builds binary matrix by NFA.
@@ -25,22 +127,7 @@ def bm_by_nfa(nfa: NondeterministicFiniteAutomaton) -> BinaryMatrix:
         }
     )
 
-    transitions = nfa.to_dict()
-    matrix = {}
-    for n_from in transitions:
-        for symbol, ns_to in transitions[n_from].items():
-            tmp = matrix.setdefault(
-                symbol.value, dok_array((len(states), len(states)), dtype=bool)
-            )
-            start_index = next(i for i, s in enumerate(states) if s.value == n_from)
-            for n_to in ns_to if isinstance(ns_to, set) else {ns_to}:
-                end_index = next(i for i, s in enumerate(states) if s.value == n_to)
-                tmp[start_index, end_index] = True
-
-    for key in matrix:
-        matrix[key] = matrix[key].tocsr()
-
-    return BinaryMatrix(states, matrix)
+    return bm_by_transitions(states, iter_nfa_transitions(nfa))
 
 
 def nfa_by_bm(bm: BinaryMatrix) -> NondeterministicFiniteAutomaton:
@@ -52,16 +139,13 @@ def nfa_by_bm(bm: BinaryMatrix) -> NondeterministicFiniteAutomaton:
     """
     nfa = NondeterministicFiniteAutomaton()
 
-    for label in bm.matrix.keys():
-        arr = bm.matrix[label].toarray()
-        for i in range(len(arr)):
-            for j in range(len(arr)):
-                if arr[i][j]:
-                    nfa.add_transition(
-                        State(bm.states[i].value),
-                        label,
-                        State(bm.states[j].value),
-                    )
+    for label, m in bm.matrix.items():
+        for i, j in zip(*backend_of(m).nonzero(m)):
+            nfa.add_transition(
+                State(bm.states[i].value),
+                label,
+                State(bm.states[j].value),
+            )
 
     for st in bm.states:
         if st.is_start:
@@ -72,24 +156,204 @@ def nfa_by_bm(bm: BinaryMatrix) -> NondeterministicFiniteAutomaton:
     return nfa
 
 
-def transitive_closure(bm: BinaryMatrix) -> tuple:
+ClosureStats = namedtuple("ClosureStats", "strategy iterations nnz")
+"""
+Namedtuple of closure strategy name, number of matrix multiplication rounds and number
+of nonzero cells of closure before the first and after every round.
+"""
+
+
+def adjacency(bm: BinaryMatrix):
+    """
+    Merges matrices of all labels of binary matrix into one adjacency matrix
+    stored by their common backend.
+
+    :param bm: Binary matrix to merge.
+    :return: Adjacency matrix.
+    """
+    n = len(bm.states)
+    backend = common_backend(*bm.matrix.values())
+    adj = backend.zeros((n, n))
+    for m in bm.matrix.values():
+        adj = backend.add(adj, backend.convert(m))
+    return adj
+
+
+def _adapt(policy: BackendPolicy | None, tc, *others) -> tuple:
+    """
+    Switches closure matrix to the backend chosen by policy together with the other
+    matrices it is combined with.
+    """
+    if policy is None:
+        return tc, *others
+    tc = policy.adapt(tc)
+    backend = backend_of(tc)
+    return tc, *(backend.convert(m) for m in others)
+
+
+def closure_by_squaring(
+    adj, policy: BackendPolicy | None = None, rows=None
+) -> tuple[object, ClosureStats]:
+    """
+    Computes transitive closure of adjacency matrix by repeated squaring.
+
+    :param adj: Adjacency matrix.
+    :param policy: Policy to switch backend of closure between rounds. If None, then backend of adj is kept.
+    :param rows: Not used, squares need all rows.
+    :return: Transitive closure matrix and statistics of computation.
+    """
+    tc = adj
+    nnz = [backend_of(tc).nnz(tc)]
+
+    while True:
+        backend = backend_of(tc)
+        tc = backend.matmul_add(tc, tc, tc)
+        nnz.append(backend.nnz(tc))
+        if nnz[-2] == nnz[-1]:
+            break
+        (tc,) = _adapt(policy, tc)
+
+    return tc, ClosureStats("squaring", len(nnz) - 1, nnz)
+
+
+def closure_semi_naive(
+    adj, policy: BackendPolicy | None = None, rows=None
+) -> tuple[object, ClosureStats]:
+    """
+    Computes transitive closure of adjacency matrix by semi-naive iteration.
+    Only pairs found in the previous iteration are propagated: ``delta @ adj``.
+    Policy chooses backends of closure and delta separately, since delta is usually
+    much sparser than closure.
+
+    :param adj: Adjacency matrix.
+    :param policy: Policy to switch backend of closure between rounds. If None, then backend of adj is kept.
+    :param rows: Not used, all rows are computed.
+    :return: Transitive closure matrix and statistics of computation.
+    """
+    tc = delta = adj
+    nnz = [backend_of(tc).nnz(tc)]
+
+    while backend_of(delta).nnz(delta):
+        backend = backend_of(tc)
+        step = common_backend(delta, adj)
+        found = step.matmul(step.convert(delta), step.convert(adj))
+        delta = backend.difference(backend.convert(found), tc)
+        tc = backend.add(tc, delta)
+        nnz.append(backend.nnz(tc))
+        if policy is not None:
+            tc, delta = policy.adapt(tc), policy.adapt(delta)
+
+    return tc, ClosureStats("semi-naive", len(nnz) - 1, nnz)
+
+
+def closure_by_scc(
+    adj, policy: BackendPolicy | None = None, rows=None
+) -> tuple[csr_array, ClosureStats]:
+    """
+    Computes transitive closure of adjacency matrix on DAG of strongly connected
+    components, see project.utils.scc. Adjacency matrix is converted to CSR.
+
+    :param adj: Adjacency matrix.
+    :param policy: Not used, closure is always computed on condensed graph.
+    :param rows: Indices of states to expand closure rows for, other rows are empty.
+        If None, then all rows are expanded.
+    :return: Transitive closure matrix and statistics of computation.
+    """
+    adj = SPARSE.convert(adj)
+    tc = expand_scc_closure(scc_closure(adj), rows)
+    return tc, ClosureStats("scc", 1, [adj.nnz, tc.nnz])
+
+
+CLOSURE_STRATEGIES = {
+    "squaring": closure_by_squaring,
+    "semi-naive": closure_semi_naive,
+    "scc": closure_by_scc,
+}
+"""
+Available strategies of transitive closure computation.
+"""
+
+
+def closure_with_stats(
+    bm: BinaryMatrix,
+    strategy: str = "squaring",
+    policy: BackendPolicy | None = None,
+    rows=None,
+) -> tuple[object, ClosureStats]:
+    """
+    Computes transitive closure matrix of binary matrix with given strategy.
+
+    :param bm: Binary matrix to compute.
+    :param strategy: Name of strategy from CLOSURE_STRATEGIES.
+    :param policy: Policy to choose backend of closure. If None, then backend of binary matrix is kept.
+    :param rows: Indices of states whose closure rows are needed, strategies may leave
+        other rows empty. If None, then all rows are needed.
+    :return: Transitive closure matrix and statistics of computation.
+    :raises ValueError: if strategy is unknown.
+    """
+    if strategy not in CLOSURE_STRATEGIES:
+        raise ValueError(f"Unknown transitive closure strategy: {strategy}")
+    adj = adjacency(bm)
+    if policy is not None:
+        adj = policy.adapt(adj)
+    return CLOSURE_STRATEGIES[strategy](adj, policy, rows)
+
+
+def transitive_closure(
+    bm: BinaryMatrix,
+    strategy: str = "squaring",
+    policy: BackendPolicy | None = None,
+    rows=None,
+) -> tuple:
     """
     Computes transitive closure of binary matrix.
 
     :param bm: Binary matrix to compute.
+    :param strategy: Name of strategy from CLOSURE_STRATEGIES.
+    :param policy: Policy to choose backend of closure. If None, then backend of binary matrix is kept.
+    :param rows: Indices of states whose closure rows are needed, see closure_with_stats.
     :return: Transitive closure of binary matrix.
     """
+    tc, _ = closure_with_stats(bm, strategy, policy, rows)
+    return backend_of(tc).nonzero(tc)
+
+
+def sources_transitive_closure(bm: BinaryMatrix, sources) -> csr_array:
+    """
+    Computes rows of transitive closure of binary matrix for given states only.
+    Every row is a BFS front propagated from its source, so cost depends on the region
+    reachable from sources rather than on number of states.
+
+    :param bm: Binary matrix to compute.
+    :param sources: Indices of states to compute closure rows for.
+    :return: CSR matrix of shape (len(sources), N) of states reachable by non-empty paths.
+    """
     n = len(bm.states)
-    tc = sum(bm.matrix.values(), start=csr_array((n, n), dtype=bool))
-    tc.eliminate_zeros()
+    m = len(sources)
+    adj = SPARSE.convert(adjacency(bm))
+    front = SPARSE.matmul(csr_by_coo(np.arange(m), sources, (m, n)), adj)
+    visited = front
+    while front.nnz:
+        front = SPARSE.difference(SPARSE.matmul(front, adj), visited)
+        visited = SPARSE.add(visited, front)
 
-    while True:
-        prev_nnz = tc.nnz
-        tc += tc @ tc
-        if prev_nnz == tc.nnz:
-            break
+    return visited
+
+
+def reversed_bm(bm: BinaryMatrix) -> BinaryMatrix:
+    """
+    Builds binary matrix of reversed automaton: matrices of labels are transposed,
+    start and final states are swapped.
+
+    :param bm: Binary matrix to reverse.
+    :return: Binary matrix with CSR matrices.
+    """
+    states = [StateInfo(st.value, st.is_final, st.is_start) for st in bm.states]
+    matrix = {
+        label: SPARSE.convert(SPARSE.convert(m).T) for label, m in bm.matrix.items()
+    }
 
-    return tc.nonzero()
+    return BinaryMatrix(states, matrix)
 
 
 def intersect(bm_l: BinaryMatrix, bm_r: BinaryMatrix) -> BinaryMatrix:
@@ -98,7 +362,7 @@ def intersect(bm_l: BinaryMatrix, bm_r: BinaryMatrix) -> BinaryMatrix:
 
     :param bm_l: Left-hand side binary matrix.
     :param bm_r: Right-hand side binary matrix.
-    :return: Intersection of two binary matrices.
+    :return: Intersection of two binary matrices with matrices of their common labels.
     """
     states = [
         StateInfo(
@@ -109,15 +373,47 @@ def intersect(bm_l: BinaryMatrix, bm_r: BinaryMatrix) -> BinaryMatrix:
         for st1, st2 in product(bm_l.states, bm_r.states)
     ]
 
+    # Labels of only one side have no product transitions, so they get no matrices
+    symbols = [symbol for symbol in bm_l.matrix if symbol in bm_r.matrix]
+    backend = product_backend(
+        *(bm_l.matrix[symbol] for symbol in symbols),
+        *(bm_r.matrix[symbol] for symbol in symbols),
+    )
+    matrix = {
+        symbol: backend.kron(
+            backend.convert(bm_l.matrix[symbol]),
+            backend.convert(bm_r.matrix[symbol]),
+        )
+        for symbol in symbols
+    }
+
+    return BinaryMatrix(states, matrix)
+
+
+def disjoint_union(bms: list) -> BinaryMatrix:
+    """
+    Builds binary matrix of disjoint union of automata. Every state value is tagged by
+    index of its automaton and states are placed automaton by automaton, so matrices of
+    labels are block diagonal.
+
+    :param bms: Binary matrices to unite.
+    :return: Binary matrix with states (index, value) and CSR matrices.
+    """
+    states = [
+        StateInfo((i, st.value), st.is_start, st.is_final)
+        for i, bm in enumerate(bms)
+        for st in bm.states
+    ]
+
     matrix = {}
-    n = len(states)
-    for symbol in set(bm_l.matrix.keys()).union(set(bm_r.matrix.keys())):
-        if symbol in bm_l.matrix and symbol in bm_r.matrix:
-            matrix[symbol] = csr_array(
-                kron(bm_l.matrix[symbol], bm_r.matrix[symbol], format="csr")
-            )
-        else:
-            matrix[symbol] = csr_array((n, n), dtype=bool)
+    for label in {label for bm in bms for label in bm.matrix}:
+        blocks = [
+            SPARSE.convert(bm.matrix[label])
+            if label in bm.matrix
+            else SPARSE.zeros((len(bm.states), len(bm.states)))
+            for bm in bms
+        ]
+        matrix[label] = csr_array(block_diag(blocks, format="csr"), dtype=bool)
 
     return BinaryMatrix(states, matrix)
 
@@ -127,8 +423,8 @@ def direct_sum(bm_l: BinaryMatrix, bm_r: BinaryMatrix) -> BinaryMatrix:
 
     matrix = {}
     for symbol in set(bm_l.matrix.keys()).intersection(set(bm_r.matrix.keys())):
-        matrix[symbol] = csr_array(
-            bmat([[bm_l.matrix[symbol], None], [None, bm_r.matrix[symbol]]])
-        )
+        m_l, m_r = bm_l.matrix[symbol], bm_r.matrix[symbol]
+        backend = product_backend(m_l, m_r)
+        matrix[symbol] = backend.block_diag(backend.convert(m_l), backend.convert(m_r))
 
     return BinaryMatrix(states, matrix)
@@ -0,0 +1,179 @@
+import numpy as np
+from scipy.sparse import csr_array
+
+_WORD = 64
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _words_num(n_cols: int) -> int:
+    return (n_cols + _WORD - 1) // _WORD
+
+
+def _bits(cols: np.ndarray) -> np.ndarray:
+    return np.left_shift(np.uint64(1), (cols % _WORD).astype(np.uint64))
+
+
+def _or_shifted(dst: np.ndarray, src: np.ndarray, offset: int):
+    """
+    ORs packed rows of src into packed rows of dst starting from bit offset.
+    Bits of src that do not fit into dst must be zero.
+    """
+    word, bit = divmod(offset, _WORD)
+    width = min(src.shape[1], dst.shape[1] - word)
+    if width <= 0:
+        return
+    if bit == 0:
+        dst[:, word : word + width] |= src[:, :width]
+        return
+    dst[:, word : word + width] |= src[:, :width] << np.uint64(bit)
+    width = min(src.shape[1], dst.shape[1] - word - 1)
+    if width > 0:
+        dst[:, word + 1 : word + 1 + width] |= src[:, :width] >> np.uint64(_WORD - bit)
+
+
+class BitMatrix:
+    """
+    Boolean matrix with every row packed into uint64 words: bit ``j % 64`` of word
+    ``j // 64`` of a row is cell ``j``. Padding bits after the last column are always zero.
+
+    :param words: Array of shape (rows, ceil(cols / 64)) of packed rows.
+    :param n_cols: Number of columns.
+    """
+
+    def __init__(self, words: np.ndarray, n_cols: int):
+        self.words = words
+        self.n_cols = n_cols
+
+    @classmethod
+    def zeros(cls, shape: tuple) -> "BitMatrix":
+        return cls(
+            np.zeros((shape[0], _words_num(shape[1])), dtype=np.uint64), shape[1]
+        )
+
+    @classmethod
+    def eye(cls, n: int) -> "BitMatrix":
+        m = cls.zeros((n, n))
+        diag = np.arange(n)
+        m.words[diag, diag // _WORD] = _bits(diag)
+        return m
+
+    @classmethod
+    def from_dense(cls, arr: np.ndarray) -> "BitMatrix":
+        arr = np.asarray(arr, dtype=bool)
+        m = cls.zeros(arr.shape)
+        packed = np.packbits(arr, axis=1, bitorder="little")
+        m.words.view(np.uint8)[:, : packed.shape[1]] = packed
+        return m
+
+    @classmethod
+    def from_sparse(cls, matrix) -> "BitMatrix":
+        m = cls.zeros(matrix.shape)
+        rows, cols = matrix.nonzero()
+        np.bitwise_or.at(m.words, (rows, cols // _WORD), _bits(cols))
+        return m
+
+    @property
+    def shape(self) -> tuple:
+        return self.words.shape[0], self.n_cols
+
+    @property
+    def nnz(self) -> int:
+        return int(_POPCOUNT[self.words.view(np.uint8)].sum(dtype=np.int64))
+
+    @property
+    def nbytes(self) -> int:
+        return self.words.nbytes
+
+    def copy(self) -> "BitMatrix":
+        return BitMatrix(self.words.copy(), self.n_cols)
+
+    def toarray(self, rows: slice = slice(None)) -> np.ndarray:
+        bits = np.unpackbits(self.words[rows].view(np.uint8), axis=1, bitorder="little")
+        return bits[:, : self.n_cols].astype(bool)
+
+    def tocsr(self) -> csr_array:
+        rows, cols = self.nonzero()
+        return csr_array(
+            (np.ones(len(rows), dtype=bool), (rows, cols)), shape=self.shape, dtype=bool
+        )
+
+    def nonzero(self, block: int = 1024) -> tuple:
+        """
+        Finds indices of nonzero cells unpacking at most block rows at once.
+        """
+        rows, cols = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for start in range(0, self.shape[0], block):
+            i, j = np.nonzero(self.toarray(slice(start, start + block)))
+            rows.append(i + start)
+            cols.append(j)
+        return np.concatenate(rows), np.concatenate(cols)
+
+    def diagonal(self) -> np.ndarray:
+        n = min(self.shape)
+        diag = np.arange(n)
+        return (self.words[diag, diag // _WORD] & _bits(diag)) != 0
+
+    def _check_shape(self, other: "BitMatrix"):
+        if self.shape != other.shape:
+            raise ValueError(f"inconsistent shapes: {self.shape} and {other.shape}")
+
+    def __or__(self, other: "BitMatrix") -> "BitMatrix":
+        self._check_shape(other)
+        return BitMatrix(self.words | other.words, self.n_cols)
+
+    def __ior__(self, other: "BitMatrix") -> "BitMatrix":
+        self._check_shape(other)
+        self.words |= other.words
+        return self
+
+    def __and__(self, other: "BitMatrix") -> "BitMatrix":
+        self._check_shape(other)
+        return BitMatrix(self.words & other.words, self.n_cols)
+
+    def __gt__(self, other: "BitMatrix") -> "BitMatrix":
+        # Same as for boolean scipy matrices: cells set in self and unset in other
+        self._check_shape(other)
+        return BitMatrix(self.words & ~other.words, self.n_cols)
+
+    # Boolean semiring: addition is OR
+    __add__ = __or__
+    __iadd__ = __ior__
+
+    def __matmul__(self, other: "BitMatrix") -> "BitMatrix":
+        """
+        Boolean multiplication: every row of result is OR of rows of other
+        selected by bits of the corresponding row of self.
+        """
+        if self.n_cols != other.shape[0]:
+            raise ValueError(f"inconsistent shapes: {self.shape} and {other.shape}")
+        res = BitMatrix.zeros((self.shape[0], other.n_cols))
+        nonempty = np.flatnonzero(other.words.any(axis=1))
+        for k in nonempty:
+            rows = (self.words[:, k // _WORD] >> np.uint64(k % _WORD)) & np.uint64(1)
+            rows = np.flatnonzero(rows)
+            if len(rows):
+                res.words[rows] |= other.words[k]
+        return res
+
+    def kron(self, other: "BitMatrix") -> "BitMatrix":
+        """
+        Kronecker product: for every nonzero cell (i, j) of self packed rows of other
+        are shifted to column j * other.n_cols of row block i.
+        """
+        p, q = self.shape
+        r, s = other.shape
+        res = BitMatrix.zeros((p * r, q * s))
+        for i, j in zip(*self.nonzero()):
+            _or_shifted(res.words[i * r : (i + 1) * r], other.words, j * s)
+        return res
+
+    def block_diag(self, other: "BitMatrix") -> "BitMatrix":
+        p, q = self.shape
+        r, s = other.shape
+        res = BitMatrix.zeros((p + r, q + s))
+        res.words[:p, : self.words.shape[1]] = self.words
+        _or_shifted(res.words[p:], other.words, q)
+        return res
+
+    def __repr__(self):
+        return f"<BitMatrix of shape {self.shape} with {self.nnz} stored elements>"
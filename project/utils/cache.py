@@ -0,0 +1,462 @@
+from collections import OrderedDict, namedtuple
+from hashlib import blake2b
+from pathlib import Path
+import numpy as np
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG
+from pyformlang.finite_automaton import NondeterministicFiniteAutomaton
+from pyformlang.regular_expression import Regex
+
+from project.utils.automata import bm_by_graph, dfa_by_regex
+from project.utils.backend import backend_of
+from project.utils.binary_matrix import BinaryMatrix, bm_by_nfa, iter_nfa_transitions
+from project.utils.ecfg import ecfg_by_cfg
+from project.utils.graph_index import GraphIndex
+from project.utils.rsm import bm_by_rsm, minimize_rsm, rsm_by_ecfg
+from project.utils.storage import save_bm, load_bm, StorageError
+
+QUERY_CACHE_SIZE = 256
+"""
+Default maximum number of compiled queries in cache.
+"""
+
+CacheStats = namedtuple("CacheStats", "hits misses entries size")
+"""
+Namedtuple of numbers of cache hits and misses, number of cached values and their total size.
+"""
+
+CompiledQuery = namedtuple("CompiledQuery", "automaton bm")
+"""
+Namedtuple of compiled query automaton (minimal DFA of regex or minimal RSM of grammar)
+and its binary matrix.
+"""
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by total size of its values.
+
+    :param max_size: Maximum total size of cached values.
+    :param sizeof: Function computing size of value. If None, then every value has size 1.
+    """
+
+    def __init__(self, max_size: int, sizeof=None):
+        self.max_size = max_size
+        self._sizeof = sizeof if sizeof is not None else (lambda value: 1)
+        self._items = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(self.hits, self.misses, len(self._items), self._size)
+
+    def get(self, key, default=None):
+        """
+        Finds value by key and marks it as recently used, counts hit or miss.
+        """
+        if key not in self._items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value):
+        """
+        Caches value evicting least recently used ones until total size fits.
+        Value larger than maximum size is not cached.
+        """
+        self.pop(key)
+        size = self._sizeof(value)
+        if size > self.max_size:
+            return
+        self._items[key] = (value, size)
+        self._size += size
+        while self._size > self.max_size:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self._size -= evicted
+
+    def resize(self, key):
+        """
+        Recomputes size of cached value after it has grown, evicting least recently
+        used values until total size fits. Missing key is ignored.
+        """
+        if key in self._items:
+            self.put(key, self._items[key][0])
+
+    def pop(self, key, default=None):
+        if key not in self._items:
+            return default
+        value, size = self._items.pop(key)
+        self._size -= size
+        return value
+
+    def get_or_build(self, key, build):
+        """
+        Finds value by key or builds and caches it.
+
+        :param key: Key of value.
+        :param build: Function without arguments building value.
+        :return: Cached or built value.
+        """
+        value = self.get(key, self)
+        if value is self:
+            value = build()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+
+def bm_nbytes(bm: BinaryMatrix) -> int:
+    """
+    Estimates memory occupied by binary matrix.
+
+    :param bm: Binary matrix.
+    :return: Number of bytes of matrix arrays plus 64 bytes per state.
+    """
+    return 64 * len(bm.states) + sum(map(_matrix_nbytes, bm.matrix.values()))
+
+
+def index_nbytes(index: GraphIndex) -> int:
+    """
+    Estimates memory occupied by graph index.
+
+    :param index: Graph index.
+    :return: Number of bytes of its source binary matrix and of matrices built by index.
+    """
+    return bm_nbytes(index.source) + sum(map(_matrix_nbytes, index.built_matrices()))
+
+
+def _matrix_nbytes(m) -> int:
+    if backend_of(m).name == "sparse":
+        return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+    return m.nbytes
+
+
+def _entry_nbytes(value: BinaryMatrix | GraphIndex) -> int:
+    if isinstance(value, GraphIndex):
+        return index_nbytes(value)
+    return bm_nbytes(value)
+
+
+def _multiset_digest(items) -> bytes:
+    # Sum of item digests does not depend on order and, unlike xor, counts repeated items
+    digests = np.frombuffer(
+        b"".join(
+            [blake2b(repr(item).encode(), digest_size=16).digest() for item in items]
+        ),
+        dtype="<u8",
+    ).reshape(-1, 2)
+    total = digests.sum(axis=0, dtype=np.uint64).astype("<u8")
+    return total.tobytes() + len(digests).to_bytes(8, "little")
+
+
+def _fingerprint(nodes, edges, start_states, final_states) -> str:
+    h = blake2b(digest_size=16)
+    for part in (nodes, edges, start_states, final_states):
+        if part is None:
+            h.update(b"\x00all")
+        else:
+            h.update(_multiset_digest(part))
+        h.update(b"\x01")
+    return h.hexdigest()
+
+
+def fingerprint_graph(
+    graph: MultiDiGraph, start_states: set = None, final_states: set = None
+) -> str:
+    """
+    Computes fingerprint of a graph by its nodes, labeled edges and start and final nodes.
+    It does not depend on order of nodes and edges and is stable between processes.
+    Digest of every node and edge is computed, which costs about as much as building
+    binary matrix of the graph.
+
+    :param graph: Graph with labeled edges.
+    :param start_states: Start states in graph. If None, then every node in graph is the starting.
+    :param final_states: Final states in graph. If None, then every node in graph is the final.
+    :return: Hex digest.
+    """
+    return _fingerprint(
+        graph.nodes,
+        graph.edges.data("label"),
+        start_states or None,
+        final_states or None,
+    )
+
+
+def fingerprint_nfa(nfa: NondeterministicFiniteAutomaton) -> str:
+    """
+    Computes fingerprint of NFA by its states, transitions and start and final states.
+
+    :param nfa: NFA.
+    :return: Hex digest.
+    """
+    return _fingerprint(
+        (st.value for st in nfa.states),
+        iter_nfa_transitions(nfa),
+        {st.value for st in nfa.start_states},
+        {st.value for st in nfa.final_states},
+    )
+
+
+def _uncached_graph_index(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    start_states: set = None,
+    final_states: set = None,
+) -> GraphIndex:
+    if not isinstance(graph, GraphIndex):
+        return GraphIndex(bm_by_graph(graph, start_states, final_states))
+    if not start_states and not final_states:
+        return graph
+    return graph.with_states(
+        bm_by_graph(graph.source, start_states, final_states).states
+    )
+
+
+class DecompositionCache:
+    """
+    Cache of binary matrices of graphs and NFAs keyed by their fingerprints.
+    Graphs are kept in memory as their indexes, see GraphIndex, NFAs as binary matrices.
+    Values are kept in LRU order bounded by their total size including matrices built
+    by indexes, and binary matrices are optionally saved into a directory, from which
+    they are loaded memory-mapped after eviction.
+    Cached matrices are shared between callers and must not be modified.
+
+    :param max_bytes: Maximum total size of values kept in memory.
+    :param directory: Directory of on-disk tier. If None, then only memory is used.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 28, directory=None):
+        self.memory = LRUCache(max_bytes, _entry_nbytes)
+        self.directory = Path(directory) if directory is not None else None
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.memory.stats
+
+    def get_or_build(self, key: str, build) -> BinaryMatrix:
+        """
+        Finds binary matrix by fingerprint in memory, then on disk, or builds it.
+
+        :param key: Fingerprint.
+        :param build: Function without arguments building binary matrix.
+        :return: Cached or built binary matrix.
+        """
+        return self.memory.get_or_build(key, lambda: self._load_or_build(key, build))
+
+    def _load_or_build(self, key: str, build) -> BinaryMatrix:
+        if self.directory is None:
+            return build()
+        try:
+            return load_bm(self.directory / key)
+        except StorageError:
+            bm = build()
+            save_bm(bm, self.directory / key)
+            return bm
+
+    def bm_by_graph(
+        self,
+        graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+        start_states: set = None,
+        final_states: set = None,
+        key: str = None,
+    ) -> BinaryMatrix:
+        """
+        Cached version of project.utils.automata.bm_by_graph, see graph_index.
+        """
+        return self.graph_index(graph, start_states, final_states, key).source
+
+    def graph_index(
+        self,
+        graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+        start_states: set = None,
+        final_states: set = None,
+        key: str = None,
+    ) -> GraphIndex:
+        """
+        Finds label-partitioned index of a graph in memory, or builds it over binary
+        matrix loaded from disk or built by the graph. Index of the graph is cached once
+        and start and final states are applied to it, so matrices built by cached index
+        are shared by all queries over the same graph and counted in size of the index.
+        Prebuilt index is returned as is, with start and final states if they are given.
+
+        :param key: Key of graph used instead of its fingerprint, it must identify the
+            graph and be a valid file name for on-disk tier. If None, then graph is
+            fingerprinted.
+        """
+        if isinstance(graph, (BinaryMatrix, GraphIndex)):
+            return _uncached_graph_index(graph, start_states, final_states)
+        if key is None:
+            key = fingerprint_graph(graph)
+        index = self.memory.get_or_build(
+            key,
+            lambda: GraphIndex(
+                self._load_or_build(key, lambda: bm_by_graph(graph)),
+                lambda: self.memory.resize(key),
+            ),
+        )
+        return _uncached_graph_index(index, start_states, final_states)
+
+    def bm_by_nfa(self, nfa: NondeterministicFiniteAutomaton) -> BinaryMatrix:
+        """
+        Cached version of project.utils.binary_matrix.bm_by_nfa.
+        """
+        return self.get_or_build(fingerprint_nfa(nfa), lambda: bm_by_nfa(nfa))
+
+    def clear(self):
+        """
+        Clears memory tier, on-disk tier is kept.
+        """
+        self.memory.clear()
+
+
+_graph_cache: DecompositionCache | None = DecompositionCache()
+
+
+def get_graph_cache() -> DecompositionCache | None:
+    """
+    :return: Cache of binary matrices used by query engines, None if caching is disabled.
+    """
+    return _graph_cache
+
+
+def set_graph_cache(cache: DecompositionCache | None):
+    """
+    Sets cache of binary matrices used by query engines.
+
+    :param cache: New cache. If None, then caching is disabled.
+    """
+    global _graph_cache
+    _graph_cache = cache
+
+
+def cached_bm_by_graph(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    start_states: set = None,
+    final_states: set = None,
+    key: str = None,
+) -> BinaryMatrix:
+    """
+    Builds binary matrix by a graph through the cache of query engines.
+    Result must not be modified.
+    """
+    return cached_graph_index(graph, start_states, final_states, key).source
+
+
+def cached_graph_index(
+    graph: MultiDiGraph | BinaryMatrix | GraphIndex,
+    start_states: set = None,
+    final_states: set = None,
+    key: str = None,
+) -> GraphIndex:
+    """
+    Builds label-partitioned index of a graph through the cache of query engines,
+    see DecompositionCache.graph_index. Graph is cached only by explicit key, since
+    fingerprinting a graph costs about as much as building its index.
+    Matrices of index must not be modified.
+
+    :param key: Key of graph in the cache. If None, then index is built without cache.
+    """
+    if _graph_cache is None or key is None:
+        return _uncached_graph_index(graph, start_states, final_states)
+    return _graph_cache.graph_index(graph, start_states, final_states, key)
+
+
+def cached_bm_by_nfa(nfa: NondeterministicFiniteAutomaton) -> BinaryMatrix:
+    """
+    Builds binary matrix by NFA through the cache of query engines.
+    Result must not be modified.
+    """
+    if _graph_cache is None:
+        return bm_by_nfa(nfa)
+    return _graph_cache.bm_by_nfa(nfa)
+
+
+_query_cache: LRUCache | None = LRUCache(QUERY_CACHE_SIZE)
+
+
+def get_query_cache() -> LRUCache | None:
+    """
+    :return: Cache of compiled queries, None if caching is disabled.
+    """
+    return _query_cache
+
+
+def set_query_cache(cache: LRUCache | None):
+    """
+    Sets cache of compiled queries.
+
+    :param cache: New cache. If None, then caching is disabled.
+    """
+    global _query_cache
+    _query_cache = cache
+
+
+def _compile(key, build) -> CompiledQuery:
+    if _query_cache is None:
+        return build()
+    return _query_cache.get_or_build(key, build)
+
+
+def regex_key(regex: Regex) -> tuple:
+    """
+    Normalizes regular expression text, it does not depend on spaces and redundant
+    parentheses of source text.
+    """
+    return "regex", str(regex)
+
+
+def cfg_key(cfg: CFG) -> tuple:
+    """
+    Normalizes grammar text, it does not depend on order of productions.
+    """
+    start = cfg.start_symbol.value if cfg.start_symbol is not None else "S"
+    productions = sorted(
+        repr((pr.head.value, tuple(o.value for o in pr.body))) for pr in cfg.productions
+    )
+    return "cfg", start, tuple(productions)
+
+
+def compile_regex(regex: Regex) -> CompiledQuery:
+    """
+    Compiles regular expression into minimal DFA and its binary matrix through the
+    cache of compiled queries. Result must not be modified.
+
+    :param regex: Regular expression.
+    :return: Compiled query.
+    """
+
+    def build():
+        dfa = dfa_by_regex(regex)
+        return CompiledQuery(dfa, bm_by_nfa(dfa))
+
+    return _compile(regex_key(regex), build)
+
+
+def compile_cfg(cfg: CFG) -> CompiledQuery:
+    """
+    Compiles grammar into minimal RSM and its binary matrix through the cache of
+    compiled queries. Result must not be modified.
+
+    :param cfg: Context-free grammar.
+    :return: Compiled query.
+    """
+
+    def build():
+        rsm = minimize_rsm(rsm_by_ecfg(ecfg_by_cfg(cfg)))
+        return CompiledQuery(rsm, bm_by_rsm(rsm))
+
+    return _compile(cfg_key(cfg), build)
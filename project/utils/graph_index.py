@@ -0,0 +1,123 @@
+from scipy.sparse import csr_array
+
+from project.utils.backend import SPARSE
+from project.utils.binary_matrix import BinaryMatrix, StateInfo
+
+
+class GraphIndex:
+    """
+    Label-partitioned index of graph edges. Every label has forward CSR matrix of its
+    edges and reverse CSR matrix of transposed edges, which is CSC storage of the
+    forward one. Matrices are converted on their first request, so a query touches
+    matrices of labels of its own alphabet only.
+
+    :param bm: Binary matrix of graph, see bm_by_graph. Its matrices must not be modified.
+    :param on_grow: Function without arguments called after index builds a new matrix,
+        e.g. to update size of cached index. If None, then nothing is called.
+    """
+
+    def __init__(self, bm: BinaryMatrix, on_grow=None):
+        self.source = bm
+        self._forward = {}
+        self._reverse = {}
+        self._reversed_states = None
+        self._on_grow = on_grow
+
+    @property
+    def states(self) -> list:
+        return self.source.states
+
+    @property
+    def labels(self) -> set:
+        return set(self.source.matrix)
+
+    def forward(self, label) -> csr_array:
+        """
+        :param label: Label of graph edges.
+        :return: Boolean CSR matrix of edges with label.
+        :raises KeyError: if graph has no edges with label.
+        """
+        if label not in self._forward:
+            m = self.source.matrix[label]
+            # Converting CSR matrix wraps its arrays into a new object, source is kept
+            if SPARSE.owns(m):
+                self._forward[label] = m
+            else:
+                self._forward[label] = SPARSE.convert(m)
+                self._grown()
+        return self._forward[label]
+
+    def reverse(self, label) -> csr_array:
+        """
+        :param label: Label of graph edges.
+        :return: Boolean CSR matrix of reversed edges with label.
+        :raises KeyError: if graph has no edges with label.
+        """
+        if label not in self._reverse:
+            self._reverse[label] = SPARSE.convert(self.forward(label).T)
+            self._grown()
+        return self._reverse[label]
+
+    def _grown(self):
+        if self._on_grow is not None:
+            self._on_grow()
+
+    def built_matrices(self) -> list:
+        """
+        :return: Matrices built by index so far, i.e. not shared with its source binary matrix.
+        """
+        return [
+            m
+            for label, m in self._forward.items()
+            if m is not self.source.matrix[label]
+        ] + list(self._reverse.values())
+
+    def with_states(self, states: list) -> "GraphIndex":
+        """
+        Builds index of the same edges with other states, e.g. with other start and
+        final flags. Matrices built by both indexes are shared.
+
+        :param states: States of graph in order of source binary matrix.
+        :return: Graph index.
+        """
+        index = GraphIndex(BinaryMatrix(states, self.source.matrix), self._on_grow)
+        index._forward, index._reverse = self._forward, self._reverse
+        return index
+
+    def bm(self, labels=None) -> BinaryMatrix:
+        """
+        Builds binary matrix of graph restricted to given labels. Matrices are shared
+        with the index and keep their backend.
+
+        :param labels: Iterable of labels, e.g. alphabet of query. Labels without
+            edges are skipped. If None, then all labels are kept.
+        :return: Binary matrix of graph.
+        """
+        if labels is None:
+            return self.source
+        matrix = self.source.matrix
+        return BinaryMatrix(
+            self.states, {label: matrix[label] for label in labels if label in matrix}
+        )
+
+    def reversed_bm(self, labels=None) -> BinaryMatrix:
+        """
+        Builds binary matrix of reversed graph restricted to given labels: edges are
+        reversed, start and final states are swapped.
+
+        :param labels: Iterable of labels. If None, then all labels are kept.
+        :return: Binary matrix of reversed graph with CSR matrices.
+        """
+        if self._reversed_states is None:
+            self._reversed_states = [
+                StateInfo(st.value, st.is_final, st.is_start) for st in self.states
+            ]
+        labels = self.source.matrix if labels is None else labels
+        return BinaryMatrix(
+            self._reversed_states,
+            {
+                label: self.reverse(label)
+                for label in labels
+                if label in self.source.matrix
+            },
+        )
@@ -0,0 +1,134 @@
+import numpy as np
+from scipy.sparse import csr_array
+
+from project.utils.backend import SPARSE
+from project.utils.binary_matrix import BinaryMatrix, StateInfo, csr_by_coo
+from project.utils.parallel import parallel_matmul
+
+
+class LazyIntersection:
+    """
+    Intersection of two binary matrices which is never materialized.
+    Product state (i, j) of left state i and right state j has index ``i * n_r + j``,
+    states and transitions of the product are computed from the factors on demand:
+    ``(A ⊗ B) @ vec(X) = vec(A @ X @ B^T)`` for every common label.
+
+    :param bm_l: Left-hand side binary matrix.
+    :param bm_r: Right-hand side binary matrix.
+    """
+
+    def __init__(self, bm_l: BinaryMatrix, bm_r: BinaryMatrix):
+        self.bm_l = bm_l
+        self.bm_r = bm_r
+        self.n_l = len(bm_l.states)
+        self.n_r = len(bm_r.states)
+        # Labels of only one factor have no transitions in product
+        self.factors = {
+            label: (SPARSE.convert(bm_l.matrix[label]), SPARSE.convert(m_r))
+            for label, m_r in bm_r.matrix.items()
+            if label in bm_l.matrix
+        }
+        # Transposed left factors are built once instead of at every BFS level
+        self._transposed = {
+            label: SPARSE.convert(a.T) for label, (a, _) in self.factors.items()
+        }
+
+    def __len__(self):
+        return self.n_l * self.n_r
+
+    def split(self, index):
+        """
+        Finds indices of factor states by index of product state.
+        Works for integers and NumPy arrays of indices.
+        """
+        return np.divmod(index, self.n_r)
+
+    def join(self, i, j):
+        """
+        Finds index of product state by indices of factor states.
+        """
+        return np.asarray(i) * self.n_r + j
+
+    def state(self, index: int) -> StateInfo:
+        i, j = self.split(index)
+        st_l, st_r = self.bm_l.states[i], self.bm_r.states[j]
+        return StateInfo(
+            (st_l.value, st_r.value),
+            st_l.is_start and st_r.is_start,
+            st_l.is_final and st_r.is_final,
+        )
+
+    def start_indices(self) -> np.ndarray:
+        starts_l = [i for i, st in enumerate(self.bm_l.states) if st.is_start]
+        starts_r = [j for j, st in enumerate(self.bm_r.states) if st.is_start]
+        return np.add.outer(
+            np.array(starts_l, dtype=np.int64) * self.n_r,
+            np.array(starts_r, dtype=np.int64),
+        ).ravel()
+
+    def is_final(self, indices: np.ndarray) -> np.ndarray:
+        finals_l = np.array([st.is_final for st in self.bm_l.states], dtype=bool)
+        finals_r = np.array([st.is_final for st in self.bm_r.states], dtype=bool)
+        i, j = self.split(indices)
+        return finals_l[i] & finals_r[j]
+
+    def matvec(self, x: np.ndarray) -> np.ndarray:
+        """
+        Computes ``(A ⊗ B) @ x`` for boolean vector x: product states having a
+        transition to some state of x.
+        """
+        x = csr_array(np.asarray(x, dtype=bool).reshape(self.n_l, self.n_r))
+        res = csr_array((self.n_l, self.n_r), dtype=bool)
+        for a, b in self.factors.values():
+            res = res + a @ x @ b.T
+        return res.toarray().ravel()
+
+    def rmatmul(self, front: csr_array) -> csr_array:
+        """
+        Computes ``front @ (A ⊗ B)`` for boolean matrix front of shape (m, N):
+        every row is replaced by states reachable in one step from states of the row.
+        """
+        m = front.shape[0]
+        rows, cols = front.nonzero()
+        i, j = self.split(cols)
+        # Row r of front becomes n_l rows of (n_l, n_r) matrix X_r
+        x = csr_by_coo(rows * self.n_l + i, j, (m * self.n_l, self.n_r))
+
+        res_rows, res_cols = [np.empty(0, dtype=np.int64)], [
+            np.empty(0, dtype=np.int64)
+        ]
+        for label, (_, b) in self.factors.items():
+            # X_r @ B for all r at once, then A^T @ (X_r @ B) on rearranged rows
+            y_rows, y_cols = parallel_matmul(x, b).nonzero()
+            r, i = np.divmod(y_rows, self.n_l)
+            y = csr_by_coo(i, r * self.n_r + y_cols, (self.n_l, m * self.n_r))
+            z_rows, z_cols = parallel_matmul(self._transposed[label], y).nonzero()
+            r, j = np.divmod(z_cols, self.n_r)
+            res_rows.append(r)
+            res_cols.append(self.join(z_rows, j))
+        # Cells reached by several labels are merged by one conversion
+        return csr_by_coo(
+            np.concatenate(res_rows), np.concatenate(res_cols), (m, len(self))
+        )
+
+
+def lazy_transitive_closure(
+    intersection: LazyIntersection, sources: np.ndarray
+) -> csr_array:
+    """
+    Computes rows of transitive closure of lazy intersection for given product states.
+
+    :param intersection: Lazy intersection.
+    :param sources: Indices of product states to compute closure rows for.
+    :return: Matrix of shape (len(sources), N) of states reachable by non-empty paths.
+    """
+    m = len(sources)
+    front = csr_by_coo(np.arange(m), sources, (m, len(intersection)))
+    visited = csr_array(front.shape, dtype=bool)
+
+    front = intersection.rmatmul(front)
+    while front.nnz:
+        visited = visited + front
+        front = intersection.rmatmul(front) > visited
+
+    return visited
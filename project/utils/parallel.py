@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_array, vstack
+
+MIN_BLOCK_ROWS = 256
+"""
+Minimum number of rows of one block, smaller matrices are multiplied in caller thread.
+"""
+
+_workers = 1
+_executors: dict[int, ThreadPoolExecutor] = {}
+
+
+def get_workers() -> int:
+    """
+    :return: Default number of threads of parallel operations.
+    """
+    return _workers
+
+
+def set_workers(workers: int):
+    """
+    Sets default number of threads of parallel operations.
+
+    :param workers: Number of threads, 1 disables parallelism.
+    :raises ValueError: if number of threads is not positive.
+    """
+    global _workers
+    if workers < 1:
+        raise ValueError(f"Invalid number of workers: {workers}")
+    _workers = workers
+
+
+def _executor(workers: int) -> ThreadPoolExecutor:
+    if workers not in _executors:
+        _executors[workers] = ThreadPoolExecutor(workers)
+    return _executors[workers]
+
+
+def _row_blocks(n_rows: int, workers: int | None) -> list[slice]:
+    workers = workers or _workers
+    blocks = min(workers, n_rows // MIN_BLOCK_ROWS)
+    if blocks <= 1:
+        return []
+    bounds = [n_rows * i // blocks for i in range(blocks + 1)]
+    return [slice(beg, end) for beg, end in zip(bounds, bounds[1:])]
+
+
+def _map_blocks(func, blocks: list[slice], workers: int | None) -> csr_array:
+    parts = list(_executor(workers or _workers).map(func, blocks))
+    return csr_array(vstack(parts, format="csr"), dtype=bool)
+
+
+def parallel_matmul(a, b, workers: int | None = None) -> csr_array:
+    """
+    Multiplies boolean sparse matrices splitting the left one into row blocks which are
+    multiplied in a thread pool, scipy releases GIL inside its sparse kernels.
+
+    :param a: Left-hand side matrix.
+    :param b: Right-hand side matrix.
+    :param workers: Number of threads. If None, then default one is used.
+    :return: Boolean CSR product.
+    """
+    a = csr_array(a)
+    blocks = _row_blocks(a.shape[0], workers)
+    if not blocks:
+        return csr_array(a @ b, dtype=bool)
+    b = csr_array(b)
+    return _map_blocks(lambda rows: a[rows] @ b, blocks, workers)
+
+
+def parallel_matmul_add(acc, a, b, workers: int | None = None) -> csr_array:
+    """
+    Computes ``acc + a @ b`` for boolean sparse matrices, every thread multiplies
+    its row block and ORs it into the same rows of accumulator.
+
+    :param acc: Accumulator matrix.
+    :param a: Left-hand side matrix.
+    :param b: Right-hand side matrix.
+    :param workers: Number of threads. If None, then default one is used.
+    :return: Boolean CSR result.
+    """
+    acc = csr_array(acc)
+    a = csr_array(a)
+    blocks = _row_blocks(a.shape[0], workers)
+    if not blocks:
+        return csr_array(acc + a @ b, dtype=bool)
+    b = csr_array(b)
+    return _map_blocks(lambda rows: acc[rows] + a[rows] @ b, blocks, workers)
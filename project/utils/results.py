@@ -0,0 +1,81 @@
+from collections import namedtuple
+import numpy as np
+from scipy.sparse import csr_array
+
+from project.utils.binary_matrix import csr_by_coo
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+"""
+Default number of answers decoded in one chunk.
+"""
+
+IndexResult = namedtuple("IndexResult", "nodes rows cols")
+"""
+Namedtuple of query answers as integer index arrays: NumPy object array of node values
+by their indices, indices of first nodes of pairs and indices of second nodes of pairs.
+If answers are single nodes, then rows holds their indices and cols is None.
+"""
+
+
+def node_table(nodes) -> np.ndarray:
+    """
+    Builds lookup table of node values by their indices.
+
+    :param nodes: Iterable of node values.
+    :return: NumPy object array.
+    """
+    nodes = list(nodes)
+    return np.fromiter(nodes, dtype=object, count=len(nodes))
+
+
+def csr_by_result(result: IndexResult) -> csr_array:
+    """
+    Builds boolean matrix of answer pairs by node indices.
+
+    :param result: Answers.
+    :return: CSR matrix of shape (N, N), where N is number of nodes.
+    :raises ValueError: if answers are single nodes.
+    """
+    if result.cols is None:
+        raise ValueError("Answers are single nodes, not pairs")
+    return csr_by_coo(result.rows, result.cols, len(result.nodes))
+
+
+def unique_pairs(rows, cols, n: int) -> tuple:
+    """
+    Removes duplicate pairs of node indices.
+
+    :param rows: Indices of first nodes of pairs.
+    :param cols: Indices of second nodes of pairs.
+    :param n: Number of nodes.
+    :return: Arrays of indices of unique pairs sorted by first and second nodes.
+    """
+    return csr_by_coo(rows, cols, n).nonzero()
+
+
+def iter_chunks(
+    nodes: np.ndarray,
+    rows: np.ndarray,
+    cols: np.ndarray | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """
+    Decodes node indices of answers into node values chunk by chunk, so only one
+    chunk of Python objects exists at a time.
+
+    :param nodes: Node values by their indices, see node_table.
+    :param rows: Indices of first nodes of pairs or indices of single nodes.
+    :param cols: Indices of second nodes of pairs. If None, then single nodes are decoded.
+    :param chunk_size: Maximum number of answers in one chunk.
+    :return: Generator of lists of pairs of nodes or of single nodes.
+    :raises ValueError: if chunk size is not positive.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"Invalid chunk size: {chunk_size}")
+
+    for beg in range(0, len(rows), chunk_size):
+        chunk = nodes[rows[beg : beg + chunk_size]]
+        if cols is None:
+            yield chunk.tolist()
+        else:
+            yield list(zip(chunk, nodes[cols[beg : beg + chunk_size]]))
@@ -1,10 +1,14 @@
 from collections import namedtuple
-from scipy.sparse import dok_array
 import pyformlang.cfg as c
 from pyformlang import finite_automaton as fa
 
 from project.utils.ecfg import ECFG
-from project.utils.binary_matrix import BinaryMatrix, StateInfo, transitive_closure
+from project.utils.binary_matrix import (
+    StateInfo,
+    bm_by_transitions,
+    iter_nfa_transitions,
+    transitive_closure,
+)
 
 RSM = namedtuple("RSM", "start boxes")
 
@@ -37,29 +41,17 @@ def bm_by_rsm(rsm: RSM, is_sort: bool = False):
     if is_sort:
         states.sort(key=lambda st: (st.value[0].value, st.value[1]))
 
-    matrix = {}
-    n = len(states)
-    for var, nfa in rsm.boxes.items():
-        transitions = nfa.to_dict()
-        for n_from in transitions:
-            for symbol, ns_to in transitions[n_from].items():
-                tmp = matrix.setdefault(symbol.value, dok_array((n, n), dtype=bool))
-                start_index = next(
-                    i for i, st in enumerate(states) if st.value == (var, n_from)
-                )
-                for n_to in ns_to if isinstance(ns_to, set) else {ns_to}:
-                    end_index = next(
-                        i for i, st in enumerate(states) if st.value == (var, n_to)
-                    )
-                    tmp[start_index, end_index] = True
-
-    for key in matrix:
-        matrix[key] = matrix[key].tocsr()
-
-    return BinaryMatrix(states, matrix)
-
-
-def get_reachables(rsm: RSM) -> set:
+    return bm_by_transitions(
+        states,
+        (
+            ((var, n_from), label, (var, n_to))
+            for var, nfa in rsm.boxes.items()
+            for n_from, label, n_to in iter_nfa_transitions(nfa)
+        ),
+    )
+
+
+def get_reachables(rsm: RSM, strategy: str = "squaring") -> set:
     bm = bm_by_rsm(rsm)
     nonterminals = {}
     res = set()
@@ -80,7 +72,7 @@ def get_reachables(rsm: RSM) -> set:
     while True:
         old_len = len(nonterminals)
 
-        transitive_closure_indices = zip(*transitive_closure(bm))
+        transitive_closure_indices = zip(*transitive_closure(bm, strategy))
         for n_from_i, n_to_i in transitive_closure_indices:
             n_from = bm.states[n_from_i]
             n_to = bm.states[n_to_i]
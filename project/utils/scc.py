@@ -0,0 +1,155 @@
+from collections import namedtuple
+import numpy as np
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import connected_components
+
+SCCClosure = namedtuple("SCCClosure", "labels reach")
+"""
+Namedtuple specifying transitive closure of a graph condensed by its strongly connected
+components: component index of every vertex and bitset rows of reachable components
+for every component (row ``c`` holds bit ``d`` iff component ``d`` is reachable from ``c``).
+"""
+
+
+def _membership(labels: np.ndarray, n_components: int) -> csr_array:
+    n = len(labels)
+    return csr_array(
+        (np.ones(n, dtype=bool), (np.arange(n), labels)),
+        shape=(n, n_components),
+        dtype=bool,
+    )
+
+
+def condensation(adj: csr_array) -> tuple[np.ndarray, csr_array, np.ndarray]:
+    """
+    Collapses strongly connected components of a graph.
+
+    :param adj: Adjacency matrix of graph.
+    :return: Component index of every vertex, adjacency matrix of condensed DAG without
+        loops and mask of components that have a cycle inside.
+    """
+    n_components, labels = connected_components(adj, directed=True, connection="strong")
+    rows, cols = csr_array(adj).nonzero()
+    rows, cols = labels[rows], labels[cols]
+
+    cyclic = np.zeros(n_components, dtype=bool)
+    cyclic[rows[rows == cols]] = True
+    # Loops are dropped from coordinates, so sparsity structure is never changed
+    dag = rows != cols
+    condensed = csr_array(
+        (np.ones(dag.sum(), dtype=bool), (rows[dag], cols[dag])),
+        shape=(n_components, n_components),
+        dtype=bool,
+    )
+    condensed.sum_duplicates()
+
+    return labels, condensed, cyclic
+
+
+def topological_order(dag: csr_array) -> np.ndarray:
+    """
+    Sorts vertices of DAG topologically by Kahn's algorithm.
+
+    :param dag: Adjacency matrix of DAG.
+    :return: Vertices in topological order.
+    """
+    n = dag.shape[0]
+    in_degree = np.bincount(dag.indices, minlength=n)
+    order = list(np.flatnonzero(in_degree == 0))
+
+    for v in order:
+        succ = dag.indices[dag.indptr[v] : dag.indptr[v + 1]]
+        in_degree[succ] -= 1
+        order.extend(succ[in_degree[succ] == 0])
+
+    return np.array(order, dtype=np.int64)
+
+
+def _set_bits(row: np.ndarray, bits: np.ndarray):
+    np.bitwise_or.at(
+        row, bits >> 6, np.left_shift(np.uint64(1), (bits & 63).astype(np.uint64))
+    )
+
+
+def scc_closure(adj: csr_array) -> SCCClosure:
+    """
+    Computes transitive closure of a graph on DAG of its strongly connected components.
+    Components are processed in reverse topological order, so every bitset row is
+    built once by OR-ing rows of already finished successors.
+
+    :param adj: Adjacency matrix of graph.
+    :return: Condensed transitive closure.
+    """
+    labels, dag, cyclic = condensation(adj)
+    n_components = dag.shape[0]
+    reach = np.zeros((n_components, (n_components + 63) // 64), dtype=np.uint64)
+
+    for c in topological_order(dag)[::-1]:
+        succ = dag.indices[dag.indptr[c] : dag.indptr[c + 1]]
+        if len(succ):
+            reach[c] = np.bitwise_or.reduce(reach[succ], axis=0)
+            _set_bits(reach[c], succ)
+        if cyclic[c]:
+            _set_bits(reach[c], np.array([c]))
+
+    return SCCClosure(labels, reach)
+
+
+def scc_reaches(closure: SCCClosure, i: int, j: int) -> bool:
+    """
+    Checks whether vertex j is reachable from vertex i by a non-empty path.
+
+    :param closure: Condensed transitive closure.
+    :param i: Index of the first vertex.
+    :param j: Index of the second vertex.
+    :return: True if j is reachable from i, False otherwise.
+    """
+    a, b = closure.labels[i], closure.labels[j]
+    return bool((int(closure.reach[a, b >> 6]) >> (b & 63)) & 1)
+
+
+def expand_scc_closure(closure: SCCClosure, rows=None, block: int = 1024) -> csr_array:
+    """
+    Expands condensed transitive closure back to vertices of the original graph.
+    Only bitset rows of components of requested vertices are unpacked, at most block
+    rows at once.
+
+    :param closure: Condensed transitive closure.
+    :param rows: Indices of vertices to expand closure rows for. If None, then all rows are expanded.
+    :param block: Maximum number of bitset rows unpacked at once.
+    :return: Transitive closure matrix with original vertex indices.
+    """
+    n_components = closure.reach.shape[0]
+    p = _membership(closure.labels, n_components)
+    components = (
+        np.arange(n_components)
+        if rows is None
+        else np.unique(closure.labels[np.asarray(rows, dtype=np.int64)])
+    )
+
+    comp_rows, comp_cols = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for beg in range(0, len(components), block):
+        part = components[beg : beg + block]
+        bits = np.unpackbits(
+            closure.reach[part].astype("<u8").view(np.uint8), axis=1, bitorder="little"
+        )
+        i, j = np.nonzero(bits[:, :n_components])
+        comp_rows.append(part[i])
+        comp_cols.append(j)
+    reach = csr_array(
+        (
+            np.ones(sum(map(len, comp_cols)), dtype=bool),
+            (np.concatenate(comp_rows), np.concatenate(comp_cols)),
+        ),
+        shape=(n_components, n_components),
+        dtype=bool,
+    )
+
+    if rows is not None:
+        mask = np.zeros(len(closure.labels), dtype=bool)
+        mask[rows] = True
+        p_rows = csr_array(p.multiply(mask[:, None]), dtype=bool)
+    else:
+        p_rows = p
+
+    return csr_array(p_rows @ reach @ p.T, dtype=bool)
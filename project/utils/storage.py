@@ -0,0 +1,111 @@
+import json
+import pickle
+from pathlib import Path
+import numpy as np
+from scipy.sparse import csr_array
+
+from project.utils.backend import SPARSE
+from project.utils.binary_matrix import BinaryMatrix, StateInfo
+
+FORMAT_VERSION = 1
+
+
+class StorageError(Exception):
+    """
+    Exception for invalid stored binary matrices
+
+    :param msg: Error message
+    """
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def save_bm(bm: BinaryMatrix, path) -> Path:
+    """
+    Saves binary matrix into the directory of the following files:
+    ``meta.json`` with format version and sizes, ``states.pkl`` and ``labels.pkl`` with
+    pickled state values and labels, ``flags.npy`` with start and final flags of states
+    and ``<i>.data.npy``, ``<i>.indices.npy``, ``<i>.indptr.npy`` with CSR arrays of the
+    i-th label.
+
+    :param bm: Binary matrix to save.
+    :param path: Path to directory, it is created if does not exist.
+    :return: Path to directory.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    labels = list(bm.matrix)
+    with open(path / "states.pkl", "wb") as f:
+        pickle.dump([st.value for st in bm.states], f)
+    with open(path / "labels.pkl", "wb") as f:
+        pickle.dump(labels, f)
+    np.save(
+        path / "flags.npy",
+        np.array([[st.is_start, st.is_final] for st in bm.states], dtype=bool).reshape(
+            -1, 2
+        ),
+    )
+
+    for i, label in enumerate(labels):
+        m = SPARSE.convert(bm.matrix[label])
+        m.sum_duplicates()
+        np.save(path / f"{i}.data.npy", m.data)
+        np.save(path / f"{i}.indices.npy", m.indices)
+        np.save(path / f"{i}.indptr.npy", m.indptr)
+
+    with open(path / "meta.json", "w") as f:
+        json.dump(
+            {
+                "version": FORMAT_VERSION,
+                "states": len(bm.states),
+                "labels": len(labels),
+            },
+            f,
+        )
+
+    return path
+
+
+def load_bm(path, mmap: bool = True) -> BinaryMatrix:
+    """
+    Loads binary matrix saved by save_bm.
+
+    :param path: Path to directory.
+    :param mmap: Enable to map CSR arrays into memory instead of reading them, so
+        opening is instant and processes loading the same matrix share page cache.
+        Mapped arrays are read-only.
+    :return: Binary matrix with CSR matrices.
+    :raises StorageError: if directory does not contain binary matrix of known format.
+    """
+    path = Path(path)
+    try:
+        with open(path / "meta.json", "r") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise StorageError(f"No binary matrix in {path}")
+    if meta.get("version") != FORMAT_VERSION:
+        raise StorageError(f"Unsupported format version: {meta.get('version')}")
+
+    with open(path / "states.pkl", "rb") as f:
+        values = pickle.load(f)
+    with open(path / "labels.pkl", "rb") as f:
+        labels = pickle.load(f)
+    flags = np.load(path / "flags.npy")
+    states = [
+        StateInfo(value, bool(is_start), bool(is_final))
+        for value, (is_start, is_final) in zip(values, flags)
+    ]
+
+    n = len(states)
+    mmap_mode = "r" if mmap else None
+    matrix = {}
+    for i, label in enumerate(labels):
+        data, indices, indptr = (
+            np.load(path / f"{i}.{name}.npy", mmap_mode=mmap_mode)
+            for name in ("data", "indices", "indptr")
+        )
+        matrix[label] = csr_array((data, indices, indptr), shape=(n, n), copy=False)
+
+    return BinaryMatrix(states, matrix)
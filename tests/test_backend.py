@@ -0,0 +1,119 @@
+from time import perf_counter
+import numpy as np
+import pytest
+from pyformlang.regular_expression import Regex
+from scipy.sparse import csr_array
+
+from project.algorithms.rpq import tensor_rpq
+from project.utils.automata import nfa_by_graph
+from project.utils.backend import (
+    AUTO,
+    BACKENDS,
+    BIT,
+    DENSE,
+    SPARSE,
+    BackendPolicy,
+    MatrixBackend,
+    backend_of,
+)
+from project.utils.binary_matrix import (
+    bm_by_nfa,
+    bm_with_backend,
+    closure_with_stats,
+    transitive_closure,
+    CLOSURE_STRATEGIES,
+)
+from project.utils.graph import generate_labeled_two_cycles_graph
+
+
+def random_bool(shape: tuple, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).random(shape) < 0.3
+
+
+@pytest.mark.parametrize("backend", BACKENDS.values())
+def test_backend_operations(backend: MatrixBackend):
+    a, b = random_bool((5, 5), 0), random_bool((5, 5), 1)
+    c, d = backend.convert(csr_array(a)), backend.convert(b)
+
+    def dense(m) -> np.ndarray:
+        return DENSE.convert(m)
+
+    assert backend_of(c) is backend
+    assert np.array_equal(dense(backend.zeros((2, 3))), np.zeros((2, 3), dtype=bool))
+    assert np.array_equal(dense(backend.eye(4)), np.eye(4, dtype=bool))
+    assert np.array_equal(dense(backend.add(c, d)), a | b)
+    assert np.array_equal(dense(backend.difference(c, d)), a & ~b)
+    assert np.array_equal(dense(backend.matmul(c, d)), (a.astype(int) @ b) > 0)
+    assert np.array_equal(dense(backend.kron(c, d)), np.kron(a, b))
+    diag = dense(backend.block_diag(c, d))
+    assert np.array_equal(diag[:5, :5], a) and np.array_equal(diag[5:, 5:], b)
+    assert not diag[:5, 5:].any() and not diag[5:, :5].any()
+    assert backend.nnz(c) == a.sum()
+    assert set(zip(*backend.nonzero(c))) == set(zip(*np.nonzero(a)))
+
+
+@pytest.mark.parametrize(
+    "shape, nnz, expected",
+    [
+        ((0, 0), 0, SPARSE),
+        ((100, 100), 10, SPARSE),
+        ((100, 100), 5000, DENSE),
+        ((5000, 5000), 10**7, BIT),
+    ],
+)
+def test_policy_choose(shape: tuple, nnz: int, expected: MatrixBackend):
+    assert BackendPolicy(0.01, 10**6).choose(shape, nnz) is expected
+
+
+@pytest.mark.parametrize("strategy", ["squaring", "semi-naive"])
+@pytest.mark.parametrize("dense_cells", [0, 10**6])
+def test_closure_switches_backend(strategy: str, dense_cells: int):
+    graph = generate_labeled_two_cycles_graph((20, 30), ("a", "b"))
+    bm = bm_by_nfa(nfa_by_graph(graph))
+    policy = BackendPolicy(0.1, dense_cells)
+
+    expected = set(zip(*transitive_closure(bm)))
+    tc, stats = closure_with_stats(bm, strategy, policy)
+
+    assert backend_of(tc) is (BIT if dense_cells == 0 else DENSE)
+    assert set(zip(*backend_of(tc).nonzero(tc))) == expected
+    assert stats.nnz[-1] == len(expected)
+
+
+@pytest.mark.parametrize("backend", BACKENDS.values())
+@pytest.mark.parametrize("strategy", CLOSURE_STRATEGIES)
+def test_closure_on_backend(backend: MatrixBackend, strategy: str):
+    graph = generate_labeled_two_cycles_graph((4, 3), ("a", "b"))
+    graph.add_edge(0, "tail", label="a")
+    bm = bm_by_nfa(nfa_by_graph(graph))
+
+    expected = set(zip(*transitive_closure(bm)))
+    actual = set(zip(*transitive_closure(bm_with_backend(bm, backend), strategy)))
+
+    assert actual == expected
+
+
+def test_auto_closure_not_slower_than_sparse():
+    # Closure of two cycles is dense, so AUTO switches it away from CSR
+    graph = generate_labeled_two_cycles_graph((200, 150), ("a", "b"))
+    bm = bm_by_nfa(nfa_by_graph(graph))
+
+    def best_time(policy) -> float:
+        times = []
+        for _ in range(2):
+            start = perf_counter()
+            transitive_closure(bm, "squaring", policy)
+            times.append(perf_counter() - start)
+        return min(times)
+
+    assert best_time(AUTO) <= best_time(None)
+
+
+@pytest.mark.parametrize("query", ["a*", "a b*", "(a|b)* a"])
+def test_tensor_rpq_with_policy(query: str):
+    graph = generate_labeled_two_cycles_graph((5, 4), ("a", "b"))
+
+    expected = tensor_rpq(graph, Regex(query))
+
+    assert tensor_rpq(graph, Regex(query), policy=BackendPolicy(0.0, 0)) == expected
+    assert tensor_rpq(graph, Regex(query), policy=BackendPolicy()) == expected
@@ -2,11 +2,19 @@ import pytest
 from pyformlang.finite_automaton import NondeterministicFiniteAutomaton, State
 
 from project.utils.binary_matrix import (
+    StateInfo,
     bm_by_nfa,
+    bm_by_transitions,
     nfa_by_bm,
     intersect,
     transitive_closure,
+    adjacency,
+    closure_with_stats,
+    CLOSURE_STRATEGIES,
 )
+from project.utils.automata import nfa_by_graph
+from project.utils.graph import generate_labeled_two_cycles_graph
+from project.utils.scc import scc_closure, scc_reaches, expand_scc_closure
 from test_utils import load_test_res, nfa_by_transactions
 
 
@@ -16,6 +24,38 @@ def test_build_empty():
     assert nfa.is_empty()
 
 
+@pytest.mark.parametrize("transitions", load_test_res("test_intersect"))
+def test_bm_by_transitions(transitions):
+    transitions_list = transitions[0]
+    values = sorted({v for n_from, _, n_to in transitions_list for v in (n_from, n_to)})
+    states = [StateInfo(v, False, False) for v in values]
+
+    # Duplicated transitions must collapse into a single cell
+    bm = bm_by_transitions(states, transitions_list + transitions_list)
+
+    actual = {
+        (values[i], label, values[j])
+        for label, m in bm.matrix.items()
+        for i, j in zip(*m.nonzero())
+    }
+    assert bm.states == states
+    assert actual == set(map(tuple, transitions_list))
+    assert sum(m.nnz for m in bm.matrix.values()) == len(actual)
+
+
+def test_intersect_common_labels():
+    bm_l = bm_by_transitions(
+        [StateInfo(0, True, False), StateInfo(1, False, True)],
+        [(0, "a", 1), (1, "b", 0)],
+    )
+    bm_r = bm_by_transitions([StateInfo(0, True, True)], [(0, "a", 0), (0, "c", 0)])
+
+    intersection = intersect(bm_l, bm_r)
+
+    assert set(intersection.matrix) == {"a"}
+    assert intersection.matrix["a"].nonzero()[0].tolist() == [0]
+
+
 @pytest.mark.parametrize(
     "nfa",
     map(
@@ -74,10 +114,53 @@ def test_intersect(
         load_test_res("test_transitive_closure"),
     ),
 )
+@pytest.mark.parametrize("strategy", CLOSURE_STRATEGIES)
 def test_transitive_closure(
-    nfa: NondeterministicFiniteAutomaton, expected: list[list[bool]]
+    nfa: NondeterministicFiniteAutomaton, expected: list[list[bool]], strategy: str
 ):
     bm = bm_by_nfa(nfa)
-    actual = set(zip(*transitive_closure(bm)))
+    actual = set(zip(*transitive_closure(bm, strategy)))
 
     assert actual == expected
+
+
+@pytest.mark.parametrize("n", [1, 2, 7, 20])
+def test_closure_strategies_on_chain(n: int):
+    bm = bm_by_nfa(nfa_by_transactions([(i, "a", i + 1) for i in range(n)], {0}, {n}))
+    results = {
+        strategy: closure_with_stats(bm, strategy) for strategy in CLOSURE_STRATEGIES
+    }
+
+    expected = {(i, j) for i in range(n + 1) for j in range(i + 1, n + 1)}
+    for strategy, (tc, stats) in results.items():
+        actual = {
+            (bm.states[i].value, bm.states[j].value) for i, j in zip(*tc.nonzero())
+        }
+        assert actual == expected
+        assert stats.strategy == strategy
+        assert len(stats.nnz) == stats.iterations + 1
+        assert stats.nnz == sorted(stats.nnz)
+        assert stats.nnz[-1] == len(expected)
+
+
+@pytest.mark.parametrize("nodes_num", [(1, 1), (3, 2), (10, 20)])
+def test_scc_closure_two_cycles(nodes_num: tuple):
+    graph = generate_labeled_two_cycles_graph(nodes_num, ("a", "b"))
+    # Add a tail out of cycles to have more than one component
+    graph.add_edge(0, "tail", label="a")
+    bm = bm_by_nfa(nfa_by_graph(graph))
+
+    expected, _ = closure_with_stats(bm, "squaring")
+    closure = scc_closure(adjacency(bm))
+
+    assert len(set(closure.labels)) == 2
+    assert (expand_scc_closure(closure) != expected).nnz == 0
+    for i, j in zip(*expected.nonzero()):
+        assert scc_reaches(closure, i, j)
+    tail = next(i for i, st in enumerate(bm.states) if st.value == "tail")
+    common = next(i for i, st in enumerate(bm.states) if st.value == 0)
+    assert not scc_reaches(closure, tail, tail)
+
+    partial = expand_scc_closure(closure, [common, tail])
+    assert set(partial.nonzero()[0]) == {common}
+    assert (partial[[common]] != expected[[common]]).nnz == 0
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from pyformlang.finite_automaton import NondeterministicFiniteAutomaton
+from scipy.sparse import csr_array, kron
+
+from project.utils.bit_matrix import BitMatrix
+from project.utils.binary_matrix import (
+    bm_by_nfa,
+    bit_packed_bm,
+    direct_sum,
+    intersect,
+    transitive_closure,
+    CLOSURE_STRATEGIES,
+)
+from test_utils import load_test_res, nfa_by_transactions
+
+SHAPES = [(0, 0), (1, 1), (3, 5), (64, 64), (70, 130), (129, 63)]
+
+
+def random_bool(shape: tuple, seed: int, density: float = 0.1) -> np.ndarray:
+    return np.random.default_rng(seed).random(shape) < density
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_pack_unpack(shape: tuple):
+    arr = random_bool(shape, 0, 0.3)
+
+    from_dense = BitMatrix.from_dense(arr)
+    from_sparse = BitMatrix.from_sparse(csr_array(arr))
+
+    assert from_dense.shape == shape
+    assert np.array_equal(from_dense.words, from_sparse.words)
+    assert np.array_equal(from_dense.toarray(), arr)
+    assert from_dense.nnz == arr.sum()
+    assert (from_dense.tocsr() != csr_array(arr)).nnz == 0
+    assert np.array_equal(from_dense.diagonal(), np.diagonal(arr))
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_elementwise(shape: tuple):
+    a, b = random_bool(shape, 1, 0.5), random_bool(shape, 2, 0.5)
+    bit_a, bit_b = BitMatrix.from_dense(a), BitMatrix.from_dense(b)
+
+    assert np.array_equal((bit_a | bit_b).toarray(), a | b)
+    assert np.array_equal((bit_a & bit_b).toarray(), a & b)
+    assert np.array_equal((bit_a > bit_b).toarray(), a & ~b)
+    bit_a += bit_b
+    assert np.array_equal(bit_a.toarray(), a | b)
+
+
+@pytest.mark.parametrize("n, k, m", [(0, 0, 0), (1, 1, 1), (5, 70, 3), (70, 65, 130)])
+def test_matmul(n: int, k: int, m: int):
+    a, b = random_bool((n, k), 3), random_bool((k, m), 4)
+
+    actual = BitMatrix.from_dense(a) @ BitMatrix.from_dense(b)
+
+    assert np.array_equal(actual.toarray(), (a.astype(int) @ b.astype(int)) > 0)
+
+
+@pytest.mark.parametrize("shape_l", [(1, 1), (2, 3), (5, 70)])
+@pytest.mark.parametrize("shape_r", [(1, 1), (3, 7), (65, 64)])
+def test_kron_and_block_diag(shape_l: tuple, shape_r: tuple):
+    a, b = random_bool(shape_l, 5, 0.5), random_bool(shape_r, 6, 0.5)
+    bit_a, bit_b = BitMatrix.from_dense(a), BitMatrix.from_dense(b)
+
+    assert np.array_equal(bit_a.kron(bit_b).toarray(), np.kron(a, b))
+    expected = np.zeros(np.add(shape_l, shape_r), dtype=bool)
+    expected[: shape_l[0], : shape_l[1]] = a
+    expected[shape_l[0] :, shape_l[1] :] = b
+    assert np.array_equal(bit_a.block_diag(bit_b).toarray(), expected)
+
+
+@pytest.mark.parametrize(
+    "nfa",
+    map(
+        lambda res: nfa_by_transactions(res[0], res[1], res[2]),
+        load_test_res("test_intersect"),
+    ),
+)
+@pytest.mark.parametrize("strategy", CLOSURE_STRATEGIES)
+def test_bit_packed_binary_matrix(nfa: NondeterministicFiniteAutomaton, strategy: str):
+    bm = bm_by_nfa(nfa)
+    bit_bm = bit_packed_bm(bm)
+
+    expected = set(zip(*transitive_closure(bm)))
+    assert set(zip(*transitive_closure(bit_bm, strategy))) == expected
+
+    for op in (intersect, direct_sum):
+        expected = op(bm, bm)
+        actual = op(bit_bm, bit_bm)
+        assert expected.states == actual.states
+        assert expected.matrix.keys() == actual.matrix.keys()
+        for label, m in actual.matrix.items():
+            assert isinstance(m, BitMatrix)
+            assert np.array_equal(m.toarray(), expected.matrix[label].toarray())
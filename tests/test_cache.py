@@ -0,0 +1,167 @@
+import pytest
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG
+from pyformlang.regular_expression import Regex
+
+from project.algorithms.cfpq import matrix_cfpq, tensor_cfpq
+from project.algorithms.rpq import tensor_rpq, bfs_rpq
+from project.utils.automata import nfa_by_graph, bm_by_graph
+from project.utils.cache import (
+    LRUCache,
+    DecompositionCache,
+    bm_nbytes,
+    cached_graph_index,
+    cfg_key,
+    compile_cfg,
+    compile_regex,
+    regex_key,
+    fingerprint_graph,
+    fingerprint_nfa,
+    get_graph_cache,
+    get_query_cache,
+    set_graph_cache,
+    set_query_cache,
+)
+from project.utils.graph import generate_labeled_two_cycles_graph
+
+
+@pytest.fixture
+def graph_cache():
+    prev = get_graph_cache()
+    cache = DecompositionCache()
+    set_graph_cache(cache)
+    yield cache
+    set_graph_cache(prev)
+
+
+@pytest.fixture
+def query_cache():
+    prev = get_query_cache()
+    cache = LRUCache(2)
+    set_query_cache(cache)
+    yield cache
+    set_query_cache(prev)
+
+
+def test_lru_eviction():
+    cache = LRUCache(5, len)
+    cache.put("a", "xx")
+    cache.put("b", "yy")
+    assert cache.get("a") == "xx"
+    cache.put("c", "zz")
+    assert "b" not in cache
+    assert cache.get("b") is None
+    cache.put("d", "too long")
+    assert "d" not in cache
+    assert cache.stats == (1, 1, 2, 4)
+
+
+def test_fingerprint_graph():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    reordered = MultiDiGraph()
+    reordered.add_edges_from(reversed(list(graph.edges(data=True))))
+    changed = graph.copy()
+    changed.add_edge(0, 1, label="b")
+    repeated = graph.copy()
+    repeated.add_edges_from(list(graph.edges(data=True))[:1])
+
+    fingerprint = fingerprint_graph(graph)
+    assert fingerprint_graph(reordered) == fingerprint
+    assert fingerprint_graph(changed) != fingerprint
+    assert fingerprint_graph(repeated) != fingerprint
+    assert fingerprint_graph(graph, {0}) != fingerprint
+    assert fingerprint_graph(graph, None, {0}) != fingerprint_graph(graph, {0})
+    assert fingerprint_nfa(nfa_by_graph(graph)) == fingerprint_nfa(
+        nfa_by_graph(reordered)
+    )
+
+
+def test_decomposition_cache(tmp_path):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    other = generate_labeled_two_cycles_graph((4, 3), ("a", "b"))
+    expected = bm_by_graph(graph, {0})
+    cache = DecompositionCache(bm_nbytes(expected), tmp_path)
+
+    bm = cache.bm_by_graph(graph, {0})
+    assert cache.bm_by_graph(graph, {1}).matrix is bm.matrix
+    assert cache.stats.hits == 1
+
+    # Evicts the first matrix from memory, then loads it from disk
+    cache.bm_by_graph(other)
+    loaded = cache.bm_by_graph(graph, {0})
+    assert loaded.matrix is not bm.matrix
+    assert loaded.states == expected.states
+    for label, m in loaded.matrix.items():
+        assert (m != expected.matrix[label]).nnz == 0
+
+
+@pytest.mark.parametrize("query", ["a* b", "(a|b)* a"])
+def test_rpq_cached(graph_cache, query: str):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    regex = Regex(query)
+    expected = tensor_rpq(bm_by_graph(graph, {0}), regex)
+
+    assert tensor_rpq(graph, regex, {0}) == expected
+    assert graph_cache.stats.entries == 0
+
+    assert tensor_rpq(graph, regex, {0}, key="two-cycles") == expected
+    assert bfs_rpq(graph, regex, {0}, separated=True, key="two-cycles") == expected
+    assert bfs_rpq(graph, regex, separated=True, key="two-cycles") == tensor_rpq(
+        graph, regex
+    )
+    assert graph_cache.stats.entries == 1
+    assert graph_cache.stats.hits == 2
+
+
+def test_rpq_by_prebuilt_index(graph_cache):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    regex = Regex("a* b")
+    index = cached_graph_index(graph, key="two-cycles")
+
+    assert cached_graph_index(graph, key="two-cycles") is index
+    assert tensor_rpq(index, regex, {0}) == tensor_rpq(graph, regex, {0})
+    assert bfs_rpq(index, regex, separated=True) == tensor_rpq(graph, regex)
+    # Prebuilt index is not looked up, graphs without key are not cached
+    assert graph_cache.stats.hits == 1
+    assert graph_cache.stats.entries == 1
+
+
+def test_cfpq_cached(graph_cache):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    cfg = CFG.from_text("S -> a S b | a b")
+    expected = tensor_cfpq(graph, cfg)
+
+    assert tensor_cfpq(graph, cfg, key="two-cycles") == expected
+    assert matrix_cfpq(graph, cfg, key="two-cycles") == expected
+    assert graph_cache.stats.entries == 1
+    assert graph_cache.stats.hits == 1
+
+
+def test_query_keys():
+    assert regex_key(Regex("a*  (b|c)")) == regex_key(Regex("(a)* (b | c)"))
+    assert regex_key(Regex("a b")) != regex_key(Regex("ab"))
+    assert cfg_key(CFG.from_text("S -> a S b | $")) == cfg_key(
+        CFG.from_text("S -> $\nS -> a S b")
+    )
+    assert cfg_key(CFG.from_text("S -> a S b | $")) != cfg_key(
+        CFG.from_text("S -> a S b | a b")
+    )
+
+
+def test_compiled_queries(query_cache):
+    compiled = compile_regex(Regex("a* b"))
+    assert compile_regex(Regex("(a*) b")) is compiled
+    compile_cfg(CFG.from_text("S -> a S b | $"))
+    compile_regex(Regex("b"))
+
+    assert compile_regex(Regex("a* b")) is not compiled
+    assert query_cache.stats == (1, 4, 2, 2)
+
+
+@pytest.mark.parametrize("cfg", ["S -> a S b | $", "S -> a | S S"])
+def test_cfpq_with_compiled_grammar(query_cache, cfg: str):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    expected = tensor_cfpq(graph, CFG.from_text(cfg))
+
+    assert tensor_cfpq(graph, CFG.from_text(cfg)) == expected
+    assert query_cache.stats.hits == 1
@@ -1,3 +1,4 @@
+from functools import partial
 import pytest
 import pyformlang.cfg as c
 from networkx import MultiDiGraph
@@ -5,12 +6,18 @@ from networkx import MultiDiGraph
 from project.algorithms.cfpq import (
     helling_constrained_transitive_closure,
     helling_cfpq,
+    helling_cfpq_indices,
+    iter_helling_cfpq,
+    iter_matrix_cfpq,
+    iter_tensor_cfpq,
     matrix_constrained_transitive_closure,
     matrix_cfpq,
+    matrix_cfpq_indices,
     tensor_cfpq,
+    tensor_cfpq_indices,
     tensor_constrained_transitive_closure,
 )
-from project.utils.graph import get_graph_by_dot
+from project.utils.graph import generate_labeled_two_cycles_graph, get_graph_by_dot
 from test_utils import load_test_res
 
 
@@ -34,6 +41,7 @@ from test_utils import load_test_res
         helling_constrained_transitive_closure,
         matrix_constrained_transitive_closure,
         tensor_constrained_transitive_closure,
+        partial(tensor_constrained_transitive_closure, lazy=True),
     ],
 )
 def test_constrained_transitive(graph, cfg, expected, ctc):
@@ -56,7 +64,9 @@ def test_constrained_transitive(graph, cfg, expected, ctc):
         load_test_res("test_helling"),
     ),
 )
-@pytest.mark.parametrize("cfpq", [helling_cfpq, matrix_cfpq, tensor_cfpq])
+@pytest.mark.parametrize(
+    "cfpq", [helling_cfpq, matrix_cfpq, tensor_cfpq, partial(tensor_cfpq, lazy=True)]
+)
 def test_cfpq(
     graph: MultiDiGraph,
     query: c.CFG,
@@ -69,3 +79,94 @@ def test_cfpq(
     actual = cfpq(graph, query, start_states, final_states, start)
 
     assert actual == expected
+
+
+@pytest.mark.parametrize(
+    "graph, query, start_states, final_states, start, expected",
+    map(
+        lambda r: (
+            get_graph_by_dot(r[0]),
+            c.CFG.from_text(r[1]),
+            r[2],
+            r[3],
+            r[4] if r[4] is not None else "S",
+            {tuple(pair) for pair in r[5]},
+        ),
+        load_test_res("test_helling"),
+    ),
+)
+@pytest.mark.parametrize(
+    "iter_cfpq", [iter_helling_cfpq, iter_matrix_cfpq, iter_tensor_cfpq]
+)
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_iter_cfpq(
+    graph: MultiDiGraph,
+    query: c.CFG,
+    start_states: set | None,
+    final_states: set | None,
+    start: str,
+    expected: set[tuple],
+    iter_cfpq,
+    batch_size: int,
+):
+    chunks = list(
+        iter_cfpq(
+            graph, query, start_states, final_states, start, batch_size=batch_size
+        )
+    )
+    actual = [pair for chunk in chunks for pair in chunk]
+
+    assert all(0 < len(chunk) <= batch_size for chunk in chunks)
+    assert len(actual) == len(expected)
+    assert set(actual) == expected
+
+
+@pytest.mark.parametrize(
+    "graph, query, start_states, final_states, start, expected",
+    map(
+        lambda r: (
+            get_graph_by_dot(r[0]),
+            c.CFG.from_text(r[1]),
+            r[2],
+            r[3],
+            r[4] if r[4] is not None else "S",
+            {tuple(pair) for pair in r[5]},
+        ),
+        load_test_res("test_helling"),
+    ),
+)
+@pytest.mark.parametrize(
+    "cfpq_indices", [helling_cfpq_indices, matrix_cfpq_indices, tensor_cfpq_indices]
+)
+def test_cfpq_indices(
+    graph: MultiDiGraph,
+    query: c.CFG,
+    start_states: set | None,
+    final_states: set | None,
+    start: str,
+    expected: set[tuple],
+    cfpq_indices,
+):
+    result = cfpq_indices(graph, query, start_states, final_states, start)
+
+    assert len(result.nodes) == graph.number_of_nodes()
+    assert len(result.rows) == len(expected)
+    assert set(zip(result.nodes[result.rows], result.nodes[result.cols])) == expected
+
+
+@pytest.mark.parametrize(
+    "cfg",
+    [
+        "S -> a S b | a b",
+        "S -> S S | a S b | $",
+        "S -> A B\nA -> a A | a\nB -> b B | $",
+        "S -> A B | B\nA -> a A b | a b\nB -> C C\nC -> b | a C",
+    ],
+)
+def test_helling_on_two_cycles_graph(cfg: str):
+    graph = generate_labeled_two_cycles_graph((9, 7), ("a", "b"))
+    cfg = c.CFG.from_text(cfg)
+
+    assert helling_constrained_transitive_closure(
+        graph, cfg
+    ) == matrix_constrained_transitive_closure(graph, cfg)
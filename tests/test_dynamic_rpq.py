@@ -0,0 +1,49 @@
+import random
+import pytest
+from pyformlang.regular_expression import Regex
+
+from project.algorithms.dynamic_rpq import IncrementalRPQ
+from project.algorithms.rpq import tensor_rpq
+from project.utils.graph import generate_labeled_two_cycles_graph
+
+
+@pytest.mark.parametrize("query", ["a* b", "(a|b)* a", "b b*", "a a"])
+@pytest.mark.parametrize("starts, finals", [(None, None), ({0, 2}, {1, 3, 5})])
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_rpq(query: str, starts: set | None, finals: set | None, seed: int):
+    rnd = random.Random(seed)
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    index = IncrementalRPQ(graph, Regex(query), starts, finals)
+    assert index.pairs() == tensor_rpq(graph, Regex(query), starts, finals)
+
+    for _ in range(10):
+        edges = list(graph.edges.data("label"))
+        if edges and rnd.random() < 0.5:
+            removed = rnd.sample(edges, min(len(edges), rnd.randint(1, 3)))
+            for u, v, label in removed:
+                keys = [key for key, d in graph[u][v].items() if d["label"] == label]
+                graph.remove_edge(u, v, key=keys[0])
+            index.remove_edges(removed)
+        else:
+            added = [
+                (rnd.randint(0, 9), rnd.randint(0, 9), rnd.choice("ab"))
+                for _ in range(rnd.randint(1, 3))
+            ]
+            for u, v, label in added:
+                graph.add_edge(u, v, label=label)
+            index.add_edges(added)
+
+        assert index.pairs() == tensor_rpq(graph, Regex(query), starts, finals)
+
+
+def test_parallel_edges():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    index = IncrementalRPQ(graph, Regex("a*"))
+    expected = index.pairs()
+
+    index.add_edges([(1, 2, "a")])
+    index.remove_edges([(1, 2, "a")])
+    assert index.pairs() == expected
+    with pytest.raises(ValueError):
+        index.remove_edges([(1, 3, "a")])
+    assert index.pairs() == expected
@@ -0,0 +1,85 @@
+import pytest
+
+from project.utils.automata import bm_by_graph, nfa_by_graph
+from project.utils.binary_matrix import bm_by_nfa
+from project.utils.cache import DecompositionCache, bm_nbytes, index_nbytes
+from project.utils.graph import generate_labeled_two_cycles_graph
+from project.utils.graph_index import GraphIndex
+
+
+def edges_of(bm) -> set:
+    return {
+        (bm.states[i].value, label, bm.states[j].value)
+        for label, m in bm.matrix.items()
+        for i, j in zip(*m.nonzero())
+    }
+
+
+@pytest.mark.parametrize("starts, finals", [(None, None), ({0}, {1, 2})])
+def test_bm_by_graph_without_nfa(starts: set | None, finals: set | None):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    actual = bm_by_graph(graph, starts, finals)
+    expected = bm_by_nfa(nfa_by_graph(graph, starts, finals))
+
+    assert set(actual.states) == set(expected.states)
+    assert edges_of(actual) == edges_of(expected)
+
+
+def test_graph_index():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    index = GraphIndex(bm_by_graph(graph, {0}, {5}))
+
+    assert index.labels == {"a", "b"}
+    assert index.forward("a") is index.forward("a")
+    assert (index.reverse("a") != index.forward("a").T).nnz == 0
+
+    bm = index.bm(["b", "c"])
+    assert bm.states == index.states
+    assert set(bm.matrix) == {"b"}
+    assert bm.matrix["b"] is index.source.matrix["b"]
+
+    reversed_bm = index.reversed_bm(["a"])
+    assert set(reversed_bm.matrix) == {"a"}
+    assert {(u, v) for v, _, u in edges_of(reversed_bm)} == {
+        (u, v) for u, v, label in graph.edges.data("label") if label == "a"
+    }
+    assert [st.value for st in reversed_bm.states if st.is_start] == [5]
+    assert [st.value for st in reversed_bm.states if st.is_final] == [0]
+
+
+def test_cached_graph_index():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    cache = DecompositionCache()
+
+    index = cache.graph_index(graph)
+    assert cache.graph_index(graph) is index
+    assert cache.graph_index(graph, key="two-cycles") is not index
+
+    # Start and final states are applied to the cached index of the graph
+    started = cache.graph_index(graph, {0})
+    assert started.source.matrix is index.source.matrix
+    assert started.states == bm_by_graph(graph, {0}).states
+    started.reverse("a")
+    assert index.reverse("a") is started.reverse("a")
+    assert cache.stats.hits == 2
+
+    cache.clear()
+    assert cache.graph_index(graph) is not index
+
+
+def test_cached_graph_index_size():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    cache = DecompositionCache(bm_nbytes(bm_by_graph(graph, {0})))
+
+    index = cache.graph_index(graph, {0})
+    assert cache.stats.size == index_nbytes(index) == bm_nbytes(index.source)
+
+    # Forward CSR matrices are the source ones and are not counted twice
+    assert index.forward("a") is index.source.matrix["a"]
+    assert cache.stats.size == index_nbytes(index) == bm_nbytes(index.source)
+
+    # Built reverse matrix does not fit into memory tier together with source
+    index.reverse("a")
+    assert index_nbytes(index) > bm_nbytes(index.source)
+    assert cache.stats.entries == 0
+    assert cache.stats.size == 0
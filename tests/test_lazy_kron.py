@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from pyformlang.regular_expression import Regex
+from scipy.sparse import csr_array
+
+from project.utils.automata import dfa_by_regex, nfa_by_graph
+from project.utils.binary_matrix import (
+    adjacency,
+    bm_by_nfa,
+    closure_with_stats,
+    intersect,
+)
+from project.utils.graph import generate_labeled_two_cycles_graph
+from project.utils.lazy_kron import LazyIntersection, lazy_transitive_closure
+
+QUERIES = ["a*", "a b", "(a|b)* b", "c"]
+
+
+def intersection_of(query: str) -> tuple:
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    graph_bm = bm_by_nfa(nfa_by_graph(graph))
+    query_bm = bm_by_nfa(dfa_by_regex(Regex(query)))
+    return LazyIntersection(graph_bm, query_bm), intersect(graph_bm, query_bm)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_states(query: str):
+    lazy, expected = intersection_of(query)
+
+    assert len(lazy) == len(expected.states)
+    assert [lazy.state(i) for i in range(len(lazy))] == expected.states
+    assert set(lazy.start_indices()) == {
+        i for i, st in enumerate(expected.states) if st.is_start
+    }
+    assert list(lazy.is_final(np.arange(len(lazy)))) == [
+        st.is_final for st in expected.states
+    ]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("seed", [0, 1])
+def test_operator(query: str, seed: int):
+    lazy, expected = intersection_of(query)
+    adj = adjacency(expected)
+    rng = np.random.default_rng(seed)
+
+    x = rng.random(len(lazy)) < 0.3
+    assert np.array_equal(lazy.matvec(x), (adj.astype(int) @ x) > 0)
+
+    front = csr_array(rng.random((5, len(lazy))) < 0.2)
+    assert (lazy.rmatmul(front) != (front @ adj)).nnz == 0
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_lazy_transitive_closure(query: str):
+    lazy, expected = intersection_of(query)
+    tc, _ = closure_with_stats(expected)
+    sources = lazy.start_indices()
+
+    assert (lazy_transitive_closure(lazy, sources) != tc[sources]).nnz == 0
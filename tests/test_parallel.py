@@ -0,0 +1,55 @@
+import pytest
+from pyformlang.regular_expression import Regex
+from scipy.sparse import random_array
+
+from project.algorithms.rpq import tensor_rpq, bfs_rpq
+from project.utils.graph import generate_labeled_two_cycles_graph
+import project.utils.parallel
+from project.utils.parallel import (
+    get_workers,
+    set_workers,
+    parallel_matmul,
+    parallel_matmul_add,
+)
+
+
+def random_bool(shape: tuple, seed: int):
+    return random_array(shape, density=0.01, random_state=seed, format="csr") > 0
+
+
+@pytest.fixture
+def workers():
+    old = get_workers()
+    yield set_workers
+    set_workers(old)
+
+
+@pytest.mark.parametrize("workers_num", [1, 2, 3, 8])
+@pytest.mark.parametrize("shape", [(0, 10, 10), (10, 10, 10), (2000, 300, 500)])
+def test_parallel_matmul(workers_num: int, shape: tuple):
+    n, k, m = shape
+    acc, a, b = random_bool((n, m), 0), random_bool((n, k), 1), random_bool((k, m), 2)
+
+    product = parallel_matmul(a, b, workers_num)
+    assert product.dtype == bool
+    assert (product != (a @ b)).nnz == 0
+    assert (parallel_matmul_add(acc, a, b, workers_num) != (acc + a @ b)).nnz == 0
+
+
+def test_set_invalid_workers(workers):
+    with pytest.raises(ValueError):
+        workers(0)
+
+
+@pytest.mark.parametrize("query", ["a* b", "(a|b)*"])
+def test_rpq_with_workers(workers, monkeypatch, query: str):
+    monkeypatch.setattr(project.utils.parallel, "MIN_BLOCK_ROWS", 1)
+    graph = generate_labeled_two_cycles_graph((30, 20), ("a", "b"))
+    starts = {0, 1, 2}
+    expected_tensor = tensor_rpq(graph, Regex(query), starts, lazy=True)
+    expected_bfs = bfs_rpq(graph, Regex(query), starts)
+
+    workers(4)
+    assert get_workers() == 4
+    assert tensor_rpq(graph, Regex(query), starts, lazy=True) == expected_tensor
+    assert bfs_rpq(graph, Regex(query), starts) == expected_bfs
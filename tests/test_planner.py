@@ -0,0 +1,44 @@
+import pytest
+from pyformlang.regular_expression import Regex
+
+from project.algorithms.planner import plan_rpq, planned_rpq
+from project.algorithms.rpq import tensor_rpq
+from project.utils.graph import generate_labeled_two_cycles_graph
+
+
+@pytest.mark.parametrize(
+    "starts, memory_limit, engine, strategy",
+    [
+        (None, 1 << 30, "tensor_rpq", "all-pairs"),
+        ({0}, 1 << 30, "tensor_rpq", "single-source"),
+        ({0, 1}, 1 << 30, "tensor_rpq", "multi-source"),
+        # All-pairs is cheaper, but only multi-source fits the limit
+        (None, 1 << 18, "tensor_rpq", "multi-source"),
+        (None, 1, "bfs_rpq", "chunked"),
+    ],
+)
+def test_plan_rpq(starts: set | None, memory_limit: int, engine: str, strategy: str):
+    graph = generate_labeled_two_cycles_graph((30, 40), ("a", "b"))
+    query = Regex("a* b")
+
+    plan = plan_rpq(graph, query, starts, None, memory_limit)
+
+    assert plan.engine == engine
+    assert plan.strategy == strategy
+    assert plan.stats.nodes == 71
+    assert plan.stats.label_edges == {"a": 31, "b": 41}
+    assert plan.estimates.keys() == {"all-pairs", "multi-source", "chunked"}
+    assert planned_rpq(graph, query, starts, None, plan) == tensor_rpq(
+        graph, query, starts, None
+    )
+
+
+def test_plan_ignores_unused_labels():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+
+    plan = plan_rpq(graph, Regex("a a*"), {0})
+
+    # Minimal DFA of "a a*" has two transitions by "a"
+    assert plan.stats.label_edges == {"a": 4}
+    assert plan.stats.query_transitions == {"a": 2}
+    assert plan.estimates["multi-source"].cost == 4 * 2 + 1
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from project.utils.results import (
+    IndexResult,
+    csr_by_result,
+    iter_chunks,
+    node_table,
+    unique_pairs,
+)
+
+
+def test_node_table():
+    nodes = node_table([(0, 1), "a", 2])
+
+    assert nodes.dtype == object
+    assert nodes.tolist() == [(0, 1), "a", 2]
+
+
+def test_unique_pairs():
+    rows, cols = unique_pairs([2, 0, 2, 0], [1, 1, 1, 0], 3)
+
+    assert rows.tolist() == [0, 0, 2]
+    assert cols.tolist() == [0, 1, 1]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5])
+def test_iter_chunks(chunk_size: int):
+    result = IndexResult(node_table("abc"), np.array([0, 1, 2]), np.array([2, 2, 0]))
+
+    pairs = list(iter_chunks(*result, chunk_size=chunk_size))
+    nodes = list(iter_chunks(result.nodes, result.rows, chunk_size=chunk_size))
+
+    assert [len(chunk) for chunk in pairs] == [len(chunk) for chunk in nodes]
+    assert max(map(len, pairs)) <= chunk_size
+    assert sum(pairs, []) == [("a", "c"), ("b", "c"), ("c", "a")]
+    assert sum(nodes, []) == ["a", "b", "c"]
+    assert (csr_by_result(result).toarray() == np.eye(3, dtype=bool)[[2, 2, 0]]).all()
+
+
+def test_invalid_results():
+    with pytest.raises(ValueError):
+        csr_by_result(IndexResult(node_table("a"), np.array([0]), None))
+    with pytest.raises(ValueError):
+        next(iter_chunks(node_table("a"), np.array([0]), chunk_size=0))
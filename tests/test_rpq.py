@@ -1,10 +1,25 @@
+from functools import partial
 from networkx import MultiDiGraph
 from pyformlang.regular_expression import Regex
 import pytest
 
 from test_utils import load_test_res
+from project.utils.automata import dfa_by_regex
+from project.utils.binary_matrix import iter_nfa_transitions
 from project.utils.graph import generate_labeled_two_cycles_graph, get_graph_by_dot
-from project.algorithms.rpq import tensor_rpq, bfs_rpq
+from project.algorithms.rpq import (
+    tensor_rpq,
+    bfs_rpq,
+    iter_tensor_rpq,
+    iter_bfs_rpq,
+    tensor_rpq_indices,
+    bfs_rpq_indices,
+    bfs_rpq_exists,
+    batch_rpq,
+    batch_rpq_indices,
+    witness_paths,
+    DIRECTIONS,
+)
 
 
 @pytest.mark.parametrize(
@@ -36,9 +51,71 @@ def test_tensor_rpq_labeled_two_cycles_graph(
     assert tensor_rpq(graph, Regex(query), start_states, final_states) == expected
 
 
+@pytest.mark.parametrize("strategy", ["semi-naive", "scc"])
+@pytest.mark.parametrize(
+    "graph, query, starts, finals, expected",
+    map(
+        lambda res: (
+            get_graph_by_dot(res[0]),
+            res[1],
+            set(res[2]) if len(res[2]) else None,
+            set(res[3]) if len(res[3]) else None,
+            set(map(tuple, res[4])),
+        ),
+        load_test_res("test_bst_rpq"),
+    ),
+)
+def test_tensor_rpq_closure_strategy(
+    graph: MultiDiGraph,
+    query: str,
+    starts: set | None,
+    finals: set | None,
+    expected: set,
+    strategy: str,
+):
+    actual = tensor_rpq(graph, Regex(query), starts, finals, strategy)
+    assert actual == expected
+
+
+@pytest.mark.parametrize(
+    "query, start_states, final_states, expected",
+    map(
+        lambda res: (
+            res[0],
+            set(res[1]) if len(res[1]) else None,
+            set(res[2]) if len(res[2]) else None,
+            set(map(tuple, res[3])),
+        ),
+        load_test_res("test_rpq_labeled_two_cycles_graph_query"),
+    ),
+)
+@pytest.mark.parametrize(
+    "graph",
+    map(
+        lambda res: generate_labeled_two_cycles_graph(res[0], res[1]),
+        load_test_res("test_rpq_labeled_two_cycles_graph"),
+    ),
+)
+@pytest.mark.parametrize("options", [{"lazy": True}, {"from_sources": True}])
+def test_restricted_tensor_rpq(
+    graph: MultiDiGraph,
+    query: str,
+    start_states: set | None,
+    final_states: set | None,
+    expected: set,
+    options: dict,
+):
+    actual = tensor_rpq(graph, Regex(query), start_states, final_states, **options)
+    assert actual == expected
+
+
 @pytest.mark.parametrize("query", load_test_res("test_rpq_empty_graph_query"))
-def test_tensor_rpq_empty_graph(query: str):
-    assert tensor_rpq(MultiDiGraph(), Regex(query), None, None) == set()
+@pytest.mark.parametrize("from_sources", [False, True])
+def test_tensor_rpq_empty_graph(query: str, from_sources: bool):
+    assert (
+        tensor_rpq(MultiDiGraph(), Regex(query), None, None, from_sources=from_sources)
+        == set()
+    )
 
 
 @pytest.mark.parametrize(
@@ -79,6 +156,7 @@ def test_tensor_rpq_labeled_two_cycles_graph(
     ),
 )
 @pytest.mark.parametrize("separated", [False, True])
+@pytest.mark.parametrize("direction", DIRECTIONS)
 def test_rpq_by_bfs(
     graph: MultiDiGraph,
     query: str,
@@ -86,8 +164,11 @@ def test_rpq_by_bfs(
     finals: set | None,
     separated: bool,
     res: list,
+    direction: str,
 ):
-    actual = bfs_rpq(graph, Regex(query), starts, finals, separated)
+    actual = bfs_rpq(
+        graph, Regex(query), starts, finals, separated, direction=direction
+    )
     expected = set(map(tuple, res)) if separated else set(map(lambda r: r[1], res))
     assert actual == expected
 
@@ -105,6 +186,7 @@ def test_rpq_by_bfs(
     ),
 )
 @pytest.mark.parametrize("separated", [False, True])
+@pytest.mark.parametrize("direction", DIRECTIONS)
 @pytest.mark.parametrize(
     "graph",
     map(
@@ -119,7 +201,271 @@ def test_bfs_rpq_labeled_two_cycles_graph(
     finals: set | None,
     res: set,
     separated: bool,
+    direction: str,
+):
+    actual = bfs_rpq(
+        graph, Regex(query), starts, finals, separated, direction=direction
+    )
+    expected = set(map(tuple, res)) if separated else set(map(lambda r: r[1], res))
+    assert actual == expected
+
+
+@pytest.mark.parametrize(
+    "graph, query, starts, finals, res",
+    map(
+        lambda res: (
+            get_graph_by_dot(res[0]),
+            res[1],
+            set(res[2]) if len(res[2]) else None,
+            set(res[3]) if len(res[3]) else None,
+            res[4],
+        ),
+        load_test_res("test_bst_rpq"),
+    ),
+)
+@pytest.mark.parametrize("separated", [False, True])
+@pytest.mark.parametrize("chunk_size, processes", [(1, 1), (2, 1), (2, 2)])
+@pytest.mark.parametrize("direction", ["forward", "backward"])
+def test_chunked_bfs_rpq(
+    graph: MultiDiGraph,
+    query: str,
+    starts: set | None,
+    finals: set | None,
+    separated: bool,
+    res: list,
+    chunk_size: int,
+    processes: int,
+    direction: str,
 ):
-    actual = bfs_rpq(graph, Regex(query), starts, finals, separated)
+    actual = bfs_rpq(
+        graph,
+        Regex(query),
+        starts,
+        finals,
+        separated,
+        chunk_size,
+        processes,
+        direction=direction,
+    )
     expected = set(map(tuple, res)) if separated else set(map(lambda r: r[1], res))
     assert actual == expected
+
+
+@pytest.mark.parametrize("chunk_size, processes", [(0, 1), (1, 0)])
+def test_chunked_bfs_rpq_invalid(chunk_size: int, processes: int):
+    with pytest.raises(ValueError):
+        bfs_rpq(MultiDiGraph(), Regex("a"), chunk_size=chunk_size, processes=processes)
+
+
+@pytest.mark.parametrize(
+    "query, starts, finals, res",
+    map(
+        lambda res: (
+            res[0],
+            set(res[1]) if len(res[1]) else None,
+            set(res[2]) if len(res[2]) else None,
+            set(map(tuple, res[3])),
+        ),
+        load_test_res("test_rpq_labeled_two_cycles_graph_query"),
+    ),
+)
+@pytest.mark.parametrize(
+    "iter_rpq",
+    [
+        iter_tensor_rpq,
+        partial(iter_tensor_rpq, lazy=True),
+        partial(iter_bfs_rpq, separated=True),
+        partial(iter_bfs_rpq, separated=True, chunk_size=2),
+    ],
+)
+def test_iter_rpq(
+    query: str, starts: set | None, finals: set | None, res: set, iter_rpq
+):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    chunks = list(iter_rpq(graph, Regex(query), starts, finals, batch_size=2))
+    actual = [pair for chunk in chunks for pair in chunk]
+
+    assert all(0 < len(chunk) <= 2 for chunk in chunks)
+    assert len(actual) == len(set(actual))
+    assert set(actual) == tensor_rpq(graph, Regex(query), starts, finals)
+
+
+@pytest.mark.parametrize("limit", [1, 3, 100])
+@pytest.mark.parametrize("separated", [False, True])
+@pytest.mark.parametrize("chunk_size, processes", [(None, 1), (1, 1), (2, 2)])
+@pytest.mark.parametrize("direction", DIRECTIONS)
+def test_limited_bfs_rpq(
+    limit: int, separated: bool, chunk_size: int | None, processes: int, direction: str
+):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    full = bfs_rpq(graph, Regex("a* b"), None, {4, 5, 6}, separated)
+    actual = bfs_rpq(
+        graph,
+        Regex("a* b"),
+        None,
+        {4, 5, 6},
+        separated,
+        chunk_size,
+        processes,
+        limit=limit,
+        direction=direction,
+    )
+
+    assert len(actual) == min(limit, len(full))
+    assert actual <= full
+
+
+@pytest.mark.parametrize(
+    "starts, finals, expected",
+    [({0}, {4}, True), ({1}, {5}, False), ({1, 2}, {0, 5}, False), (None, None, True)],
+)
+@pytest.mark.parametrize("direction", DIRECTIONS)
+def test_bfs_rpq_exists(
+    starts: set | None, finals: set | None, expected: bool, direction: str
+):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    actual = bfs_rpq_exists(graph, Regex("a* b"), starts, finals, direction=direction)
+    assert actual == expected
+
+
+@pytest.mark.parametrize("options", [{"limit": 0}, {"direction": "sideways"}])
+def test_bfs_rpq_invalid_options(options: dict):
+    with pytest.raises(ValueError):
+        bfs_rpq(MultiDiGraph(), Regex("a"), **options)
+
+
+@pytest.mark.parametrize("separated", [False, True])
+@pytest.mark.parametrize(
+    "starts, finals",
+    [(None, {3}), ({0}, {3}), ({0, 4}, {2, 6}), ({5}, None), (None, None)],
+)
+def test_bfs_rpq_directions(separated: bool, starts: set | None, finals: set | None):
+    graph = generate_labeled_two_cycles_graph((20, 30), ("a", "b"))
+    query = Regex("a* b (a | b)* a")
+    expected = bfs_rpq(graph, query, starts, finals, separated, direction="forward")
+
+    for direction in DIRECTIONS[1:]:
+        actual = bfs_rpq(graph, query, starts, finals, separated, direction=direction)
+        assert actual == expected
+
+
+def test_iter_bfs_rpq_nodes():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    chunks = list(iter_bfs_rpq(graph, Regex("a* b"), {0, 1}, chunk_size=1))
+    actual = [node for chunk in chunks for node in chunk]
+
+    assert len(actual) == len(set(actual))
+    assert set(actual) == bfs_rpq(graph, Regex("a* b"), {0, 1})
+
+
+@pytest.mark.parametrize("starts, finals", [(None, None), ({0, 2}, {1, 5})])
+@pytest.mark.parametrize(
+    "rpq_indices",
+    [
+        tensor_rpq_indices,
+        partial(tensor_rpq_indices, from_sources=True),
+        partial(bfs_rpq_indices, separated=True, chunk_size=2),
+    ],
+)
+def test_rpq_indices(starts: set | None, finals: set | None, rpq_indices):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    result = rpq_indices(graph, Regex("a* b"), starts, finals)
+
+    assert result.rows.dtype.kind == result.cols.dtype.kind == "i"
+    assert len(set(zip(result.rows, result.cols))) == len(result.rows)
+    assert set(zip(result.nodes[result.rows], result.nodes[result.cols])) == tensor_rpq(
+        graph, Regex("a* b"), starts, finals
+    )
+
+
+def test_bfs_rpq_indices_nodes():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    result = bfs_rpq_indices(graph, Regex("a* b"), {0, 1})
+
+    assert result.cols is None
+    assert set(result.nodes[result.rows]) == bfs_rpq(graph, Regex("a* b"), {0, 1})
+
+
+def shortest_path_lengths(graph: MultiDiGraph, query: str, start) -> dict:
+    dfa = dfa_by_regex(Regex(query))
+    delta = {(st, label): to for st, label, to in iter_nfa_transitions(dfa)}
+    finals = {st.value for st in dfa.final_states}
+    front = [(start, st.value) for st in dfa.start_states]
+    lengths, visited, length = {}, set(), 0
+    while front:
+        length += 1
+        next_front = []
+        for node, st in front:
+            for _, to, label in graph.out_edges(node, data="label"):
+                st_to = delta.get((st, label))
+                if st_to is None or (to, st_to) in visited:
+                    continue
+                visited.add((to, st_to))
+                next_front.append((to, st_to))
+                if st_to in finals:
+                    lengths.setdefault(to, length)
+        front = next_front
+    return lengths
+
+
+@pytest.mark.parametrize("query", ["a* b", "(a|b)* a", "b b*", "a a", "a b a"])
+@pytest.mark.parametrize("starts, finals", [(None, None), ({0, 2}, {1, 5})])
+def test_witness_paths(query: str, starts: set | None, finals: set | None):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    dfa = dfa_by_regex(Regex(query))
+    paths = witness_paths(graph, Regex(query), starts, finals)
+
+    assert set(paths) == tensor_rpq(graph, Regex(query), starts, finals)
+    for (beg, end), path in paths.items():
+        assert path[0][0] == beg and path[-1][2] == end
+        assert all(e1[2] == e2[0] for e1, e2 in zip(path, path[1:]))
+        assert all(graph.has_edge(u, v) for u, _, v in path)
+        assert dfa.accepts([label for _, label, _ in path])
+        assert len(path) == shortest_path_lengths(graph, query, beg)[end]
+
+
+def test_witness_paths_subset():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    paths = witness_paths(graph, Regex("a* b"), pairs={(1, 4), (3, 5), (7, 7)})
+
+    assert paths == {
+        (1, 4): [(1, "a", 2), (2, "a", 3), (3, "a", 0), (0, "b", 4)],
+    }
+
+
+@pytest.mark.parametrize(
+    "graph, starts, finals",
+    map(
+        lambda res: (
+            get_graph_by_dot(res[0]),
+            set(res[2]) if len(res[2]) else None,
+            set(res[3]) if len(res[3]) else None,
+        ),
+        load_test_res("test_bst_rpq"),
+    ),
+)
+@pytest.mark.parametrize("chunk_size", [None, 2])
+def test_batch_rpq(
+    graph: MultiDiGraph, starts: set | None, finals: set | None, chunk_size: int
+):
+    queries = [Regex(query) for _, query, *_ in load_test_res("test_bst_rpq")]
+    actual = batch_rpq(graph, queries, starts, finals, chunk_size)
+
+    assert actual == [tensor_rpq(graph, query, starts, finals) for query in queries]
+
+
+def test_batch_rpq_repeated_queries():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    queries = [Regex("a* b"), Regex("c"), Regex("a* b"), Regex("(a | b)*")]
+    results = batch_rpq_indices(graph, queries, {0, 1})
+
+    assert len(results) == len(queries)
+    assert all(len(set(zip(r.rows, r.cols))) == len(r.rows) for r in results)
+    assert [set(zip(r.nodes[r.rows], r.nodes[r.cols])) for r in results] == [
+        tensor_rpq(graph, query, {0, 1}) for query in queries
+    ]
+
+
+@pytest.mark.parametrize("queries", [[], [Regex("a")]])
+def test_batch_rpq_empty(queries: list):
+    assert batch_rpq(MultiDiGraph(), queries) == [set() for _ in queries]
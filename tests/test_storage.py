@@ -0,0 +1,56 @@
+import pytest
+from pyformlang.regular_expression import Regex
+
+from project.algorithms.rpq import tensor_rpq, bfs_rpq
+from project.utils.automata import nfa_by_graph, bm_by_graph, AutomataUtilsError
+from project.utils.binary_matrix import bm_by_nfa
+from project.utils.graph import generate_labeled_two_cycles_graph
+from project.utils.storage import save_bm, load_bm, StorageError
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize(
+    "starts, finals", [(None, None), ({0}, {1, 2}), ({1, 3}, None)]
+)
+def test_save_load(tmp_path, mmap: bool, starts: set | None, finals: set | None):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    bm = bm_by_nfa(nfa_by_graph(graph, starts, finals))
+
+    loaded = load_bm(save_bm(bm, tmp_path / "bm"), mmap)
+
+    assert loaded.states == bm.states
+    assert loaded.matrix.keys() == bm.matrix.keys()
+    for label, m in loaded.matrix.items():
+        assert (m != bm.matrix[label]).nnz == 0
+        assert m.indices.flags.writeable != mmap
+
+
+def test_load_missing(tmp_path):
+    with pytest.raises(StorageError):
+        load_bm(tmp_path)
+
+
+@pytest.mark.parametrize("query", ["a* b", "b b*", "(a|b)* a"])
+@pytest.mark.parametrize(
+    "starts, finals", [(None, None), ({0}, {1, 2}), ({1, 5}, None)]
+)
+def test_rpq_by_loaded_bm(tmp_path, query: str, starts: set | None, finals: set | None):
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    loaded = load_bm(save_bm(bm_by_nfa(nfa_by_graph(graph)), tmp_path))
+    regex = Regex(query)
+
+    assert tensor_rpq(loaded, regex, starts, finals) == tensor_rpq(
+        graph, regex, starts, finals
+    )
+    assert bfs_rpq(loaded, regex, starts, finals, True) == bfs_rpq(
+        graph, regex, starts, finals, True
+    )
+
+
+def test_bm_by_graph_keeps_flags():
+    graph = generate_labeled_two_cycles_graph((3, 4), ("a", "b"))
+    bm = bm_by_nfa(nfa_by_graph(graph, {0}, {1}))
+
+    assert bm_by_graph(bm).states == bm.states
+    with pytest.raises(AutomataUtilsError):
+        bm_by_graph(bm, {100})